@@ -5,185 +5,110 @@ from ehrql import codelist_from_csv
 # PRIMIS
 #######################################################
 
+# Codelists are loaded lazily: a CSV is only read the first time its codelist is used
+# (eg `codelists.ast`), and is then kept for the rest of the run.
+# This means `import codelists` is cheap, and codelists that are never used are never parsed.
+# Anything using primis_summary (every PRIMIS condition, primis_atrisk and primis_variables) uses all
+# of the PRIMIS codelists, so this only helps definitions that use a few codelists directly.
+# Access codelists as attributes of the module (`import codelists`) rather than with
+# `from codelists import *`, which would load every codelist up front.
 
-# Asthma
-
-## Asthma Diagnosis code
-ast = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-ast.csv",
-  column="code",
-)
-
-## Asthma Admission codes
-astadm = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-astadm.csv",
-  column="code",
-)
-
-## Asthma inhaler or nebuliser medication codes
-astrxm1 = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-astrxm1.csv",
-  column="code",
-)
-
-## Asthma systemic steroid medication codes
-astrxm2 = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-astrxm2.csv",
-  column="code",
-)
-
-# Chronic Respiratory Disease
-resp_cov = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-resp_cov.csv",
-  column="code",
-)
-
-# Chronic heart disease codes
-chd_cov = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-chd_cov.csv",
-  column="code",
-)
-
-# CKD
-
-## Chronic kidney disease diagnostic codes
-ckd_cov = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-ckd_cov.csv",
-  column="code",
-)
-
-## Chronic kidney disease codes - all stages
-ckd15 = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-ckd15.csv",
-  column="code",
-)
-
-## Chronic kidney disease codes-stages 3 - 5
-ckd35 = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-ckd35.csv",
-  column="code",
-)
-
-# Chronic Liver disease codes
-cld = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-cld.csv",
-  column="code",
-)
-
-# Diabetes
-
-## Diabetes diagnosis codes
-diab = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-diab.csv",
-  column="code",
-)
-
-## Diabetes resolved codes
-dmres = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-dmres.csv",
-  column="code",
-)
-
-## Gestational diabetes diagnosis codes
-gdiab = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-gdiab_cod.csv",
-  column = "code",
-)
-
-# Addisons disease and hypoadrenalism diagnosis codes
-addis = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-addis_cod.csv",
-  column = "code",
-)
-
-# Pregnancy delivery codes
-pregdel = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-pregdel.csv",
-  column = "code",
-)
-
-# Pregnancy codes
-preg = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-preg.csv",
-  column = "code",
-)
-
-# Severe Mental Illness codes
-sev_mental = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-sev_mental.csv",
-  column="code",
-)
-
-# Remission codes relating to Severe Mental Illness
-smhres = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-smhres.csv",
-  column="code",
-)
-
-# Chronic Neurological Disease including Significant Learning Disorder
-cns_cov = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-cns_cov.csv",
-  column="code",
-)
-
-# Immunosuppression diagnosis codes
-immdx_cov = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-immdx_cov.csv",
-  column="code",
-)
-
-# Immunosuppression medication codes
-immrx = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-immrx.csv",
-  column="code",
-)
-
-# Immunosuppression admin codes
-immadm = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-immunosuppression-admin-codes.csv",
-  column="code",
-)
-
-# Chemotherapy or radiation (Primis)
-dxt_chemo = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-dxt_chemo_cod.csv",
-  column="code",
-)
-
-# Chronic Neurological Disease including Significant Learning Disorder
-cns_cov = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-cns_cov.csv",
-  column="code",
-)
-
-# Asplenia or Dysfunction of the Spleen codes
-spln_cov = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-spln_cov.csv",
-  column="code",
-)
-
-# Severe Obesity
-
-## BMI
-bmi = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-bmi.csv",
-  column="code",
-)
-
-## All BMI coded terms
-bmi_stage = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-bmi_stage.csv",
-  column="code",
-)
-
-## Severe Obesity code recorded
-sev_obesity = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-sev_obesity.csv",
-  column="code",
-)
-
-# Wider Learning Disability
-learndis = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-learndis.csv",
-  column="code",
-)
+codelist_files = {
+
+  # Asthma
+
+  ## Asthma Diagnosis code
+  "ast": "codelists/primis-covid19-vacc-uptake-ast.csv",
+  ## Asthma Admission codes
+  "astadm": "codelists/primis-covid19-vacc-uptake-astadm.csv",
+  ## Asthma inhaler or nebuliser medication codes
+  "astrxm1": "codelists/primis-covid19-vacc-uptake-astrxm1.csv",
+  ## Asthma systemic steroid medication codes
+  "astrxm2": "codelists/primis-covid19-vacc-uptake-astrxm2.csv",
+
+  # Chronic Respiratory Disease
+  "resp_cov": "codelists/primis-covid19-vacc-uptake-resp_cov.csv",
+
+  # Chronic heart disease codes
+  "chd_cov": "codelists/primis-covid19-vacc-uptake-chd_cov.csv",
+
+  # CKD
+
+  ## Chronic kidney disease diagnostic codes
+  "ckd_cov": "codelists/primis-covid19-vacc-uptake-ckd_cov.csv",
+  ## Chronic kidney disease codes - all stages
+  "ckd15": "codelists/primis-covid19-vacc-uptake-ckd15.csv",
+  ## Chronic kidney disease codes-stages 3 - 5
+  "ckd35": "codelists/primis-covid19-vacc-uptake-ckd35.csv",
+
+  # Chronic Liver disease codes
+  "cld": "codelists/primis-covid19-vacc-uptake-cld.csv",
+
+  # Diabetes
+
+  ## Diabetes diagnosis codes
+  "diab": "codelists/primis-covid19-vacc-uptake-diab.csv",
+  ## Diabetes resolved codes
+  "dmres": "codelists/primis-covid19-vacc-uptake-dmres.csv",
+  ## Gestational diabetes diagnosis codes
+  "gdiab": "codelists/primis-covid19-vacc-uptake-gdiab_cod.csv",
+
+  # Addisons disease and hypoadrenalism diagnosis codes
+  "addis": "codelists/primis-covid19-vacc-uptake-addis_cod.csv",
+
+  # Pregnancy delivery codes
+  "pregdel": "codelists/primis-covid19-vacc-uptake-pregdel.csv",
+
+  # Pregnancy codes
+  "preg": "codelists/primis-covid19-vacc-uptake-preg.csv",
+
+  # Severe Mental Illness codes
+  "sev_mental": "codelists/primis-covid19-vacc-uptake-sev_mental.csv",
+
+  # Remission codes relating to Severe Mental Illness
+  "smhres": "codelists/primis-covid19-vacc-uptake-smhres.csv",
+
+  # Chronic Neurological Disease including Significant Learning Disorder
+  "cns_cov": "codelists/primis-covid19-vacc-uptake-cns_cov.csv",
+
+  # Immunosuppression diagnosis codes
+  "immdx_cov": "codelists/primis-covid19-vacc-uptake-immdx_cov.csv",
+
+  # Immunosuppression medication codes
+  "immrx": "codelists/primis-covid19-vacc-uptake-immrx.csv",
+
+  # Immunosuppression admin codes
+  "immadm": "codelists/primis-covid19-vacc-uptake-immunosuppression-admin-codes.csv",
+
+  # Chemotherapy or radiation (Primis)
+  "dxt_chemo": "codelists/primis-covid19-vacc-uptake-dxt_chemo_cod.csv",
+
+  # Asplenia or Dysfunction of the Spleen codes
+  "spln_cov": "codelists/primis-covid19-vacc-uptake-spln_cov.csv",
+
+  # Severe Obesity
+
+  ## BMI
+  "bmi": "codelists/primis-covid19-vacc-uptake-bmi.csv",
+  ## All BMI coded terms
+  "bmi_stage": "codelists/primis-covid19-vacc-uptake-bmi_stage.csv",
+  ## Severe Obesity code recorded
+  "sev_obesity": "codelists/primis-covid19-vacc-uptake-sev_obesity.csv",
+
+  # Wider Learning Disability
+  "learndis": "codelists/primis-covid19-vacc-uptake-learndis.csv",
+}
+
+# codelists loaded so far
+loaded_codelists = {}
+
+# called for any attribute not defined above, ie for codelists
+def __getattr__(name):
+    if name not in codelist_files:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if name not in loaded_codelists:
+        loaded_codelists[name] = codelist_from_csv(codelist_files[name], column="code")
+    return loaded_codelists[name]
+
+def __dir__():
+    return [*globals(), *codelist_files]
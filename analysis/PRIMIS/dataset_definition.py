@@ -4,9 +4,6 @@ from ehrql.tables.tpp import patients, practice_registrations
 # import variable definitions
 from variables_function import *
 
-#Import codelists
-from codelists import *
-
 # initialise dataset
 dataset = create_dataset()
 
@@ -28,11 +25,14 @@ dataset.immunosuppressed = is_immunosuppressed(index_date) #immunosuppress group
 dataset.ckd = has_ckd(index_date) #chronic kidney disease
 dataset.crd = has_crd(index_date) # chronis respratory disease
 dataset.diabetes = has_diabetes(index_date) #diabetes
-dataset.cld = has_prior_event(cld, index_date) # chronic liver disease
-dataset.chd = has_prior_event(chd_cov, index_date) #chronic heart disease
-dataset.cns = has_prior_event(cns_cov, index_date) # chronic neurological disease
-dataset.asplenia = has_prior_event(spln_cov, index_date) # asplenia or dysfunction of the Spleen
-dataset.learndis = has_prior_event(learndis, index_date) # learning Disability
+# conditions with a single codelist, from the same codelist summaries as the conditions above
+# (so the queries are shared with them and with primis_atrisk below)
+summary = primis_summary(index_date)
+dataset.cld = summary["cld"].exists # chronic liver disease
+dataset.chd = summary["chd_cov"].exists #chronic heart disease
+dataset.cns = summary["cns_cov"].exists # chronic neurological disease
+dataset.asplenia = summary["spln_cov"].exists # asplenia or dysfunction of the Spleen
+dataset.learndis = summary["learndis"].exists # learning Disability
 dataset.smi = has_smi(index_date) #severe mental illness
 dataset.severe_obesity = has_severe_obesity(index_date) #immunosuppress grouped
 
@@ -40,9 +40,26 @@ dataset.severe_obesity = has_severe_obesity(index_date) #immunosuppress grouped
 
 dataset.primis_atrisk = primis_atrisk(index_date) # at risk (at least one of the conditions above)
 
-# EXAMPLE 3: alternatively, use the `primis_variables` function to add variables programmatically:
+# EXAMPLE 3: alternatively, use the `primis_variables` function to add variables programmatically.
+# Passing a list of index dates shares the codelist extraction across all of the dates,
+# and adds variables suffixed "_0", "_1", ...
+
+primis_variables(dataset = dataset, index_date = [index_date+years(i) for i in range(0, 2)])
+
+
+# EXAMPLE 4: with packed=True, the PRIMIS variables for each index date are packed into a single
+# integer column, one bit per variable (see primis_flag_names), adding primis_flags_0, primis_flags_1, ...
+# Arrow outputs (as written by the actions in project.yaml) already store booleans in one bit each, so this
+# only makes CSV outputs smaller; with either format, the flags for a date can be tested as one value.
+# Decode or filter on the packed columns with analysis/tools/primis_flags.py.
+
+primis_variables(dataset = dataset, index_date = [index_date+years(i) for i in range(0, 2)], packed = True)
 
-for i in range(0, 2):
-  suffix = f"_{i}"
-  primis_variables(dataset = dataset, index_date = index_date+years(i), var_name_suffix = suffix)
+# EXAMPLE 5: sensitivity analyses. The parameters of the PRIMIS definitions (look-back windows, BMI
+# threshold, ...) can be varied with PrimisParameters, and primis_sweep adds the variables for several
+# sets of parameters at once, sharing the codelist extraction, suffixed with the name of each set.
 
+primis_sweep(dataset = dataset, index_date = index_date, packed = True, parameter_sets = {
+  "bmi35": PrimisParameters(bmi_threshold = 35.0),
+  "immuno2y": PrimisParameters(immunosuppression_years = 2),
+})
@@ -0,0 +1,58 @@
+from ehrql import create_dataset
+from ehrql.tables.tpp import clinical_events, medications, patients, practice_registrations
+
+# import variable definitions
+from variables_function import *
+
+#Import codelists (loaded lazily, on first use)
+import codelists
+
+# Every clinical event and medication in a PRIMIS codelist, up to an end date, as event tables.
+#
+# Rather than evaluating the PRIMIS variables at each of many index dates, analysis/tools/primis_timeline.py
+# reads these events, walks each patient's events once, and writes the intervals during which each PRIMIS
+# condition holds. The variables on any index date up to end_date can then be looked up from the intervals.
+# Uses the same codelists as primis_summary (primis_event_codelists and primis_meds_codelists).
+
+# initialise dataset
+dataset = create_dataset()
+
+# Choose the last date of events to include
+end_date = "2024-12-31"
+
+#Dummy data
+dataset.configure_dummy_data(population_size=1000)
+
+# define dataset population: registered at some point up to end_date
+# (registration and death on each index date are not applied to the intervals)
+dataset.define_population(
+  practice_registrations.where(
+    practice_registrations.start_date.is_on_or_before(end_date)
+  ).exists_for_patient()
+)
+
+# needed for the age restriction of the severe obesity definition
+dataset.date_of_birth = patients.date_of_birth
+
+event_codes = [code for name in primis_event_codelists for code in getattr(codelists, name)]
+events = clinical_events.where(
+  clinical_events.snomedct_code.is_in(event_codes) &
+  clinical_events.date.is_on_or_before(end_date)
+)
+dataset.add_event_table(
+  "clinical_events",
+  date=events.date,
+  snomedct_code=events.snomedct_code,
+  numeric_value=events.numeric_value,
+)
+
+meds_codes = [code for name in primis_meds_codelists for code in getattr(codelists, name)]
+meds = medications.where(
+  medications.dmd_code.is_in(meds_codes) &
+  medications.date.is_on_or_before(end_date)
+)
+dataset.add_event_table(
+  "medications",
+  date=meds.date,
+  dmd_code=meds.dmd_code,
+)
@@ -0,0 +1,56 @@
+from ehrql import INTERVAL, case, create_measures, months, when
+from ehrql.tables.tpp import patients, practice_registrations
+
+# import variable definitions
+from variables_function import *
+
+# Counts of patients in each PRIMIS at-risk group, by practice, age band and sex, for many index dates.
+#
+# Rather than adding one set of PRIMIS variables per index date to a patient-level dataset and then
+# aggregating it, each measure below is evaluated with the end of each interval as the index date,
+# and ehrQL writes only the counts for each group: the output grows with the number of groups and
+# dates, not with the population. The PRIMIS functions accept INTERVAL.end_date in place of a fixed
+# index date, so the same definitions are used as in dataset_definition.py, and the codelist
+# extraction is shared across all measures and intervals.
+
+measures = create_measures()
+
+# Choose the index dates: the last day of each month from December 2020 to November 2024 (48 dates).
+# Every interval is evaluated with the whole PRIMIS tree, so the range is fixed to end at a recent
+# date with data, rather than running on past the end of the record: move it forward as data arrive.
+intervals = months(48).ending_on("2024-11-30")
+
+index_date = INTERVAL.end_date
+
+registration = practice_registrations.for_patient_on(index_date)
+
+age = patients.age_on(index_date)
+age_band = case(
+    when(age < 16).then("0-15"),
+    when(age < 50).then("16-49"),
+    when(age < 65).then("50-64"),
+    when(age < 75).then("65-74"),
+    when(age >= 75).then("75+"),
+)
+
+# denominator: registered and alive on the index date
+measures.define_defaults(
+    denominator=(
+        registration.exists_for_patient() &
+        ((patients.date_of_death > index_date) | patients.date_of_death.is_null())
+    ),
+    group_by={
+        "practice": registration.practice_pseudo_id,
+        "age_band": age_band,
+        "sex": patients.sex,
+    },
+    intervals=intervals,
+)
+
+# numerators: one measure for each PRIMIS variable added by primis_variables
+# (at risk, and each component condition)
+for name, flag in primis_flags(index_date).items():
+    measures.define_measure(name=name, numerator=flag)
+
+# Dummy data
+measures.configure_dummy_data(population_size=1000)
@@ -0,0 +1,34 @@
+from ehrql import create_dataset
+from ehrql.tables.tpp import practice_registrations
+
+# import variable definitions
+from variables_function import *
+
+# The PRIMIS variables on a sample of index dates, for the same patients as events_definition.py.
+#
+# analysis/tools/primis_timeline.py `check` runs this and events_definition.py against local tables,
+# and compares these variables with the conditions looked up from the intervals it derives from the
+# events. The dates cover each year of the events (up to its end_date), including both 29 Februaries,
+# where windows in years move.
+
+# initialise dataset
+dataset = create_dataset()
+
+# Choose the index dates to compare on (all on or before end_date in events_definition.py)
+index_dates = [
+  "2016-02-29", "2017-06-30", "2018-12-31", "2019-09-30", "2020-02-29", "2020-12-08",
+  "2021-06-30", "2022-03-31", "2023-01-01", "2023-09-30", "2024-02-29", "2024-12-31",
+]
+
+#Dummy data
+dataset.configure_dummy_data(population_size=1000)
+
+# define dataset population: as in events_definition.py
+dataset.define_population(
+  practice_registrations.where(
+    practice_registrations.start_date.is_on_or_before("2024-12-31")
+  ).exists_for_patient()
+)
+
+# adds immunosuppressed_0, ckd_0, ..., primis_atrisk_11 (see primis_variables)
+primis_variables(dataset = dataset, index_date = index_dates)
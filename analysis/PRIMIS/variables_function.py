@@ -27,6 +27,10 @@
 # Import relevant functions and scripts
 #####################################################
 
+import dataclasses
+import datetime
+import functools
+
 from ehrql import case, when, days, years
 
 import codelists
@@ -89,35 +93,253 @@ def last_prior_meds(codelist, index_date, where=True):
     )
 
 
+
+#####################################################
+# PRIMIS parameters
+#####################################################
+
+# Parameters of the PRIMIS definitions that sensitivity analyses may vary. The defaults follow
+# the PRIMIS specification, and give the same definitions as before PrimisParameters was added,
+# except for the later fix to has_severe_obesity's age restriction (now false under 18). Pass a PrimisParameters as `parameters` to the PRIMIS functions below
+# (or to primis_variables), eg
+#   primis_atrisk(index_date, parameters=PrimisParameters(bmi_threshold=35.0))
+# and see primis_sweep for evaluating several sets of parameters at once.
+@dataclasses.dataclass(frozen=True)
+class PrimisParameters:
+    # has_asthma: inhaled asthma prescription within this many years
+    asthma_inhaler_years: int = 1
+    # has_asthma: systemic steroid prescriptions within this many years
+    asthma_steroid_years: int = 2
+    # is_immunosuppressed: medication, admin and chemotherapy codes within this many years
+    immunosuppression_years: int = 3
+    # has_severe_obesity: BMI at or above this threshold
+    bmi_threshold: float = 40.0
+    # has_severe_obesity: BMI values outside (bmi_min, bmi_max) are ignored
+    bmi_min: float = 4
+    bmi_max: float = 200
+    # has_pregnancy: a pregnancy code within this many weeks, or a pregnancy code after a delivery
+    # code, both between pregnancy_recent_weeks and pregnancy_earliest_weeks
+    pregnancy_recent_weeks: int = 30
+    pregnancy_earliest_weeks: int = 65
+
+default_primis_parameters = PrimisParameters()
+
+
+#####################################################
+# Caching of PRIMIS expressions
+#####################################################
+
+# PRIMIS conditions are reused by other conditions (eg has_asthma via has_crd) and by
+# primis_atrisk, so building them afresh on every call duplicates the whole expression tree.
+# Functions decorated with @cache_by_index_date are built once per (function, index_date, parameters)
+# and the same expression is returned on subsequent calls.
+# Use clear_primis_cache() to invalidate the cache, eg after editing codelists interactively.
+
+primis_cache = {}
+primis_cache_stats = {"hits": 0, "misses": 0}
+
+def cache_by_index_date(function):
+    @functools.wraps(function)
+    def wrapper(index_date, *args, **kwargs):
+        # only plain dates (and PrimisParameters) can be used as cache keys,
+        # not ehrQL series (eg INTERVAL.end_date)
+        other_kwargs = {name: value for name, value in kwargs.items() if name != "parameters"}
+        parameters = kwargs.get("parameters", default_primis_parameters)
+        if (
+            args or other_kwargs or not isinstance(index_date, (str, datetime.date))
+            or not isinstance(parameters, PrimisParameters)
+        ):
+            return function(index_date, *args, **kwargs)
+        if isinstance(index_date, str):
+            index_date = datetime.date.fromisoformat(index_date)
+        key = (function.__name__, index_date, parameters)
+        if key in primis_cache:
+            primis_cache_stats["hits"] += 1
+        else:
+            primis_cache_stats["misses"] += 1
+            primis_cache[key] = function(index_date, **kwargs)
+        return primis_cache[key]
+    return wrapper
+
+def clear_primis_cache():
+    primis_cache.clear()
+    primis_cache_stats["hits"] = 0
+    primis_cache_stats["misses"] = 0
+
+
+#####################################################
+# Batched codelist queries
+#####################################################
+
+# The events-in-codelist frames for the PRIMIS codelists are built once and shared by every
+# condition and every index date that uses them. ehrQL does not materialise intermediate frames,
+# so each aggregation still scans clinical_events / medications; sharing the frames avoids
+# building (and filtering on) the same codelist twice, and only the date comparisons differ
+# between index dates.
+
+# names of the clinical_events codelists (in codelists.py) used in the PRIMIS definitions
+primis_event_codelists = [
+    "ast", "astadm", "resp_cov", "chd_cov", "ckd_cov", "ckd15", "ckd35", "cld",
+    "diab", "dmres", "gdiab", "addis", "pregdel", "preg", "sev_mental", "smhres",
+    "cns_cov", "immdx_cov", "immadm", "dxt_chemo", "spln_cov",
+    "bmi", "bmi_stage", "sev_obesity", "learndis",
+]
+
+# names of the medications codelists (in codelists.py) used in the PRIMIS definitions
+primis_meds_codelists = ["astrxm1", "astrxm2", "immrx"]
+
+# summary of the events matching a single codelist
+class CodelistSummary:
+    def __init__(self, events):
+        self.events = events
+
+    # restrict to events meeting a condition, returns a CodelistSummary
+    def where(self, condition):
+        return CodelistSummary(self.events.where(condition))
+
+    # restrict to events in a window before index date, returns a CodelistSummary
+    # start and end are the durations before index date at which the window starts and ends (inclusive),
+    # eg (years(2), days(0)) for the 2 years up to and including index date
+    def window(self, index_date, start, end):
+        return self.where(self.events.date.is_on_or_between(index_date - start, index_date - end))
+
+    # restrict to each of several windows before index date, returns a dict of CodelistSummary
+    # windows maps a name to a (start, end) pair as for window()
+    def windows(self, index_date, windows):
+        return {
+            name: self.window(index_date, start, end)
+            for name, (start, end) in windows.items()
+        }
+
+    # most recent event, returns a patientFrame
+    @property
+    def last(self):
+        return self.events.sort_by(self.events.date).last_for_patient()
+
+    @property
+    def exists(self):
+        return self.events.exists_for_patient()
+
+    @property
+    def last_date(self):
+        return self.last.date
+
+    # only defined for clinical_events
+    @property
+    def last_value(self):
+        return self.last.numeric_value
+
+    @property
+    def count(self):
+        return self.events.count_for_patient()
+
+# events-in-codelist for several codelists at once, returns a dict of frames keyed by codelist name.
+# These do not depend on the index date, so the same extraction is shared by every index date
+# and only the date comparisons in summarise_prior_events / summarise_prior_meds are repeated per date.
+def codelist_events(codelist_names):
+    key = ("codelist_events", tuple(codelist_names))
+    if key not in primis_cache:
+        primis_cache[key] = {
+            name: clinical_events.where(clinical_events.snomedct_code.is_in(getattr(codelists, name)))
+            for name in codelist_names
+        }
+    return primis_cache[key]
+
+# meds-in-codelist for several codelists at once, returns a dict of frames keyed by codelist name
+def codelist_meds(codelist_names):
+    key = ("codelist_meds", tuple(codelist_names))
+    if key not in primis_cache:
+        primis_cache[key] = {
+            name: medications.where(medications.dmd_code.is_in(getattr(codelists, name)))
+            for name in codelist_names
+        }
+    return primis_cache[key]
+
+# summarise events-in-codelist on or before index date for several codelists at once,
+# returns a dict of CodelistSummary keyed by codelist name
+def summarise_prior_events(codelist_names, index_date):
+    return {
+        name: CodelistSummary(events.where(events.date.is_on_or_before(index_date)))
+        for name, events in codelist_events(codelist_names).items()
+    }
+
+# summarise meds-in-codelist on or before index date for several codelists at once,
+# returns a dict of CodelistSummary keyed by codelist name
+def summarise_prior_meds(codelist_names, index_date):
+    return {
+        name: CodelistSummary(meds.where(meds.date.is_on_or_before(index_date)))
+        for name, meds in codelist_meds(codelist_names).items()
+    }
+
+# all PRIMIS codelist summaries for a given index date
+@cache_by_index_date
+def primis_summary(index_date):
+    return {
+        **summarise_prior_events(primis_event_codelists, index_date),
+        **summarise_prior_meds(primis_meds_codelists, index_date),
+    }
+
+# CodelistSummary whose exists / last_date / last_value / count are taken from a precomputed summary
+# (eg a FileCodelistSummary) rather than from the events; where / window / windows / last still use the events
+class PrecomputedCodelistSummary(CodelistSummary):
+    def __init__(self, events, summary):
+        super().__init__(events)
+        self.summary = summary
+
+    @property
+    def exists(self):
+        return self.summary.exists
+
+    @property
+    def last_date(self):
+        return self.summary.last_date
+
+    @property
+    def last_value(self):
+        return self.summary.last_value
+
+    @property
+    def count(self):
+        return self.summary.count
+
+# use precomputed codelist summaries for {index_date} in every PRIMIS function, eg the summary extracted
+# by analysis/codelist-summary/dataset_definition.py (copy codelist_summary.py and summary_variables.py
+# into this directory):
+#   summaries = summaries_from_file("output/codelist-summary/dataset.arrow", codelists.codelist_files)
+#   use_primis_summary("2020-12-08", summaries)
+# {summaries} must be keyed by the names in codelists.py, and describe events on or before {index_date}
+# (ie the summary was extracted for that date). Call this before defining any PRIMIS variables for
+# {index_date}, and again after clear_primis_cache().
+def use_primis_summary(index_date, summaries):
+    if isinstance(index_date, str):
+        index_date = datetime.date.fromisoformat(index_date)
+    events = {
+        **summarise_prior_events(primis_event_codelists, index_date),
+        **summarise_prior_meds(primis_meds_codelists, index_date),
+    }
+    primis_cache[("primis_summary", index_date, default_primis_parameters)] = {
+        name: PrecomputedCodelistSummary(summary.events, summaries[name])
+        for name, summary in events.items()
+    }
+
+
 #######################################################
 # PRIMIS
 #######################################################
 
 # Asthma
-def has_asthma(index_date):
+@cache_by_index_date
+def has_asthma(index_date, parameters=default_primis_parameters):
+    summary = primis_summary(index_date)
     # Asthma diagnosis
-    has_astdx = has_prior_event(codelists.ast, index_date)
-    # Asthma admision
-    has_astadm = has_prior_event(
-        codelists.astadm,
-        index_date,
-        where = clinical_events.date.is_on_or_between(index_date - years(2), index_date)
-    )
-    # Inhaled asthma prescription in previous year
-    has_astrx_inhaled = has_prior_meds(
-        codelists.astrxm1,
-        index_date,
-        where = medications.date.is_on_or_after(index_date - years(1))
-    )
-    # count of systemic steroid prescription inpast 2 years
-    prior_meds = medications.where(medications.date.is_on_or_before(index_date))
-    count_astrx_oral = (
-        prior_meds
-        .where(prior_meds.dmd_code.is_in(codelists.astrxm2))
-        .where(prior_meds.date.is_on_or_between(index_date - years(2), index_date))
-        .count_for_patient()
-    )
-    # Asthma 
+    has_astdx = summary["ast"].exists
+    # Asthma admision in past 2 years
+    has_astadm = summary["astadm"].window(index_date, years(2), days(0)).exists
+    # Inhaled asthma prescription in previous year (asthma_inhaler_years)
+    has_astrx_inhaled = summary["astrxm1"].window(index_date, years(parameters.asthma_inhaler_years), days(0)).exists
+    # count of systemic steroid prescription inpast 2 years (asthma_steroid_years)
+    count_astrx_oral = summary["astrxm2"].window(index_date, years(parameters.asthma_steroid_years), days(0)).count
+    # Asthma
     asthma = case(
         when(has_astadm).then(True),
         when(has_astdx & has_astrx_inhaled & (count_astrx_oral >= 2)).then(True),
@@ -126,13 +348,15 @@ def has_asthma(index_date):
     return asthma
 
 # Chronic Kidney Disease (CKD)
+@cache_by_index_date
 def has_ckd(index_date):
+    summary = primis_summary(index_date)
     # Chronic kidney disease diagnostic codes
-    has_ckd_cov = has_prior_event(codelists.ckd_cov, index_date)
+    has_ckd_cov = summary["ckd_cov"].exists
     # Chronic kidney disease codes - all stages
-    ckd15_date = last_prior_event(codelists.ckd15, index_date).date
+    ckd15_date = summary["ckd15"].last_date
     # Chronic kidney disease codes-stages 3 - 5
-    ckd35_date = last_prior_event(codelists.ckd35, index_date).date
+    ckd35_date = summary["ckd35"].last_date
     # Chronic kidney disease
     ckd = case(
         when(has_ckd_cov).then(True),
@@ -143,81 +367,74 @@ def has_ckd(index_date):
     return ckd
 
 # Chronic Respiratory Disease (CRD)
-def has_crd(index_date, where=True):
-    has_resp_cov = has_prior_event(codelists.resp_cov, index_date)
-    has_crd = has_resp_cov | has_asthma(index_date)
+@cache_by_index_date
+def has_crd(index_date, where=True, parameters=default_primis_parameters):
+    has_resp_cov = primis_summary(index_date)["resp_cov"].exists
+    has_crd = has_resp_cov | has_asthma(index_date, parameters=parameters)
     return has_crd
 
 # Severe Obesity
-def has_severe_obesity(index_date): 
+@cache_by_index_date
+def has_severe_obesity(index_date, parameters=default_primis_parameters):
+    summary = primis_summary(index_date)
     # Severe obesity only defined for people aged 18 and over
     aged18plus = patients.age_on(index_date) >= 18
     # Last BMI stage event
-    date_bmi_stage = last_prior_event(
-        codelists.bmi_stage, 
-        index_date
-    ).date
+    date_bmi_stage = summary["bmi_stage"].last_date
     # Last severe obesity event
-    date_sev_obesity = last_prior_event(
-        codelists.sev_obesity, 
-        index_date
-    ).date
+    date_sev_obesity = summary["sev_obesity"].last_date
     # Last BMI event not null
-    event_bmi = last_prior_event(
-        codelists.bmi, 
-        index_date,
-        where=(
-            clinical_events.numeric_value.is_not_null() & 
-            # Ignore out-of-range values
-            (clinical_events.numeric_value > 4) & 
-            (clinical_events.numeric_value < 200)
-        )
-    )
+    bmi = summary["bmi"]
+    event_bmi = bmi.where(
+        bmi.events.numeric_value.is_not_null() &
+        # Ignore out-of-range values
+        (bmi.events.numeric_value > parameters.bmi_min) &
+        (bmi.events.numeric_value < parameters.bmi_max)
+    ).last
     # Severe obesity
     severe_obesity = case(
-        when(aged18plus).then(False),
+        when(~aged18plus).then(False),
         when(
-            (date_sev_obesity > event_bmi.date) | 
+            (date_sev_obesity > event_bmi.date) |
             (date_sev_obesity.is_not_null() & event_bmi.date.is_null())
         ).then(True),
         when(
-            (event_bmi.date >= date_bmi_stage) & 
-            (event_bmi.numeric_value >= 40.0)
+            (event_bmi.date >= date_bmi_stage) &
+            (event_bmi.numeric_value >= parameters.bmi_threshold)
         ).then(True),
         when(
-            (date_bmi_stage.is_null()) & 
-            (event_bmi.numeric_value >= 40.0)
+            (date_bmi_stage.is_null()) &
+            (event_bmi.numeric_value >= parameters.bmi_threshold)
         ).then(True),
         otherwise=False
     )
     return severe_obesity
 
 # Pregnant variable to identify gestational diabetes
-def has_pregnancy(index_date):
+@cache_by_index_date
+def has_pregnancy(index_date, parameters=default_primis_parameters):
+    summary = primis_summary(index_date)
+    pregnancy_windows = {
+        # between 8 and 15 months prior to index date
+        "8_to_15_months": (
+            days(7 * parameters.pregnancy_earliest_weeks), days((7 * parameters.pregnancy_recent_weeks) + 1)
+        ),
+        # within 8 months prior to index date
+        "under_8_months": (days(7 * parameters.pregnancy_recent_weeks), days(0)),
+    }
+    preg = summary["preg"].windows(index_date, pregnancy_windows)
     # Pregnancy delivery code date (a delivery code between 8 and 15 months prior to index date)
-    pregAdel_date = last_prior_event(
-        codelists.pregdel,
-        index_date,
-        where=clinical_events.date.is_on_or_between(index_date - days(7 * 65), index_date - days((7 * 30) + 1))
-    ).date
+    pregAdel_date = summary["pregdel"].window(index_date, *pregnancy_windows["8_to_15_months"]).last_date
     # Pregnancy: 8 months and 15 months (a pregnancy code between 8 and 15 months prior to index date)
-    pregA_date = last_prior_event(
-        codelists.preg,
-        index_date,
-        where=clinical_events.date.is_on_or_between(index_date - days(7 * 65), index_date - days((7 * 30) + 1))
-    ).date
+    pregA_date = preg["8_to_15_months"].last_date
     # Pregnancy: <8 months (a pregnancy code within 8 months prior to index date)
-    pregB = has_prior_event(
-        codelists.preg,
-        index_date,
-        where=clinical_events.date.is_on_or_between(index_date - days(7 * 30), index_date)
-    )
+    pregB = preg["under_8_months"].exists
     # Pregnancy group
     has_pregnancy = case(
         when(pregB).then(True),
         when(
-            pregAdel_date.is_not_null() & 
-             pregA_date.is_not_null() & 
+            pregAdel_date.is_not_null() &
+             pregA_date.is_not_null() &
              (pregA_date > pregAdel_date)
         ).then(True),
         otherwise=False
@@ -225,12 +442,14 @@ def has_pregnancy(index_date):
     return has_pregnancy
 
 # Diabetes
-def has_diabetes(index_date, where=True):
-    date_diab = last_prior_event(codelists.diab, index_date).date
-    date_dmres = last_prior_event(codelists.dmres, index_date).date
-    has_gdiab = has_prior_event(codelists.gdiab, index_date)
-    has_diab_group = has_gdiab & has_pregnancy(index_date)
-    has_addis = has_prior_event(codelists.addis, index_date)
+@cache_by_index_date
+def has_diabetes(index_date, where=True, parameters=default_primis_parameters):
+    summary = primis_summary(index_date)
+    date_diab = summary["diab"].last_date
+    date_dmres = summary["dmres"].last_date
+    has_gdiab = summary["gdiab"].exists
+    has_diab_group = has_gdiab & has_pregnancy(index_date, parameters=parameters)
+    has_addis = summary["addis"].exists
     # Diabetes condition
     diabetes = case(
         when(date_dmres < date_diab).then(True),
@@ -242,30 +461,17 @@ def has_diabetes(index_date, where=True):
     return diabetes
 
 # Immunosuppression
-def is_immunosuppressed(index_date):
+@cache_by_index_date
+def is_immunosuppressed(index_date, parameters=default_primis_parameters):
+    summary = primis_summary(index_date)
     # Immunosuppression diagnosis
-    has_immdx_cov = has_prior_event(
-        codelists.immdx_cov, 
-        index_date
-    )
-    # Immunosuppression medication (within the last 3 years)
-    has_immrx = has_prior_meds(
-        codelists.immrx,
-        index_date,
-        where=medications.date.is_on_or_after(index_date - years(3))
-    )
-    # Immunosuppression admin date (within the last 3 years)
-    has_immadm = has_prior_event(
-        codelists.immadm,
-        index_date,
-        where=clinical_events.date.is_on_or_after(index_date - years(3))
-    )
-    # Chemotherapy medication date (within the last 3 years)
-    has_dxt_chemo = has_prior_event(
-        codelists.dxt_chemo,
-        index_date,
-        where=clinical_events.date.is_on_or_after(index_date - years(3))
-    )
+    has_immdx_cov = summary["immdx_cov"].exists
+    # Immunosuppression medication (within the last 3 years: immunosuppression_years)
+    has_immrx = summary["immrx"].window(index_date, years(parameters.immunosuppression_years), days(0)).exists
+    # Immunosuppression admin date (within the last 3 years: immunosuppression_years)
+    has_immadm = summary["immadm"].window(index_date, years(parameters.immunosuppression_years), days(0)).exists
+    # Chemotherapy medication date (within the last 3 years: immunosuppression_years)
+    has_dxt_chemo = summary["dxt_chemo"].window(index_date, years(parameters.immunosuppression_years), days(0)).exists
     # Immunosuppression
     immunosupp = case(
         when(has_immdx_cov).then(True),
@@ -276,11 +482,13 @@ def is_immunosuppressed(index_date):
     )
     return immunosupp
 
-# Severe mental illness 
+# Severe mental illness
+@cache_by_index_date
 def has_smi(index_date, where=True):
-    date_sev_mental = last_prior_event(codelists.sev_mental, index_date).date
+    summary = primis_summary(index_date)
+    date_sev_mental = summary["sev_mental"].last_date
     # Remission codes relating to Severe Mental Illness
-    date_smhres = last_prior_event(codelists.smhres, index_date).date
+    date_smhres = summary["smhres"].last_date
     # Severe mental illness
     smi = case(
         when(date_smhres < date_sev_mental).then(True),
@@ -290,37 +498,96 @@ def has_smi(index_date, where=True):
     return smi
 
 # At risk group
-def primis_atrisk(index_date):
+@cache_by_index_date
+def primis_atrisk(index_date, parameters=default_primis_parameters):
 
     # This definition excludes the following groups:
     #   younger adults in long-stay nursing and residential care settings
     #   pregnancy
 
+    summary = primis_summary(index_date)
+
     return (
-        is_immunosuppressed(index_date) |       # immunosuppression grouped
-        has_ckd(index_date) |                   # chronic kidney disease
-        has_crd(index_date) |                   # chronic respiratory disease
-        has_diabetes(index_date) |              # diabetes        
-        has_prior_event(codelists.cld, index_date) |      # chronic liver disease
-        has_prior_event(codelists.cns_cov, index_date) |  # chronic neurological disease
-        has_prior_event(codelists.chd_cov, index_date) |  # chronic heart disease
-        has_prior_event(codelists.spln_cov, index_date) | # asplenia or spleen dysfunction
-        has_prior_event(codelists.learndis, index_date) | # learning disability
-        has_smi(index_date) |                   # severe mental illness
-        has_severe_obesity(index_date)          # severe obesity
+        is_immunosuppressed(index_date, parameters=parameters) |    # immunosuppression grouped
+        has_ckd(index_date) |                                       # chronic kidney disease
+        has_crd(index_date, parameters=parameters) |                # chronic respiratory disease
+        has_diabetes(index_date, parameters=parameters) |           # diabetes
+        summary["cld"].exists |                                     # chronic liver disease
+        summary["cns_cov"].exists |                                 # chronic neurological disease
+        summary["chd_cov"].exists |                                 # chronic heart disease
+        summary["spln_cov"].exists |                                # asplenia or spleen dysfunction
+        summary["learndis"].exists |                                # learning disability
+        has_smi(index_date) |                                       # severe mental illness
+        has_severe_obesity(index_date, parameters=parameters)       # severe obesity
     )
 
+## the PRIMIS variables added by primis_variables, as {name: series}
+# (also used by measures_definition.py, which counts them rather than adding them to a dataset)
+def primis_flags(index_date, parameters=default_primis_parameters):
+    summary = primis_summary(index_date)
+    return {
+        "immunosuppressed": is_immunosuppressed(index_date, parameters=parameters), #immunosuppress grouped
+        "ckd": has_ckd(index_date), #chronic kidney disease
+        "crd": summary["resp_cov"].exists, #chronic respiratory disease
+        "diabetes": has_diabetes(index_date, parameters=parameters), #diabetes
+        "cld": summary["cld"].exists, # chronic liver disease
+        "chd": summary["chd_cov"].exists, #chronic heart disease
+        "cns": summary["cns_cov"].exists, # chronic neurological disease
+        "asplenia": summary["spln_cov"].exists, # asplenia or dysfunction of the Spleen
+        "learndis": summary["learndis"].exists, # learning Disability
+        "smi": has_smi(index_date), #severe mental illness
+        "severe_obesity": has_severe_obesity(index_date, parameters=parameters), # severe obesity
+        "primis_atrisk": primis_atrisk(index_date, parameters=parameters), # at risk
+    }
+
+## the PRIMIS variables packed into a single integer column, one bit per variable
+# bit i is set if variable primis_flag_names[i] is true, eg 2**1 + 2**11 for ckd and primis_atrisk
+# (decode with analysis/tools/primis_flags.py: new variables must be added at the end, so that
+# existing outputs decode the same)
+primis_flag_names = [
+    "immunosuppressed", "ckd", "crd", "diabetes", "cld", "chd",
+    "cns", "asplenia", "learndis", "smi", "severe_obesity", "primis_atrisk",
+]
+
+def packed_primis_flags(index_date, parameters=default_primis_parameters):
+    flags = primis_flags(index_date, parameters)
+    packed = 0
+    for bit, name in enumerate(primis_flag_names):
+        packed = packed + case(when(flags[name]).then(2 ** bit), otherwise=0)
+    return packed
+
 ## function to define variables across multiple dataset definitions
-def primis_variables(dataset, index_date, var_name_suffix=""):
-    dataset.add_column(f"immunosuppressed{var_name_suffix}", is_immunosuppressed(index_date)) #immunosuppress grouped
-    dataset.add_column(f"ckd{var_name_suffix}", has_ckd(index_date)) #chronic kidney disease
-    dataset.add_column(f"crd{var_name_suffix}", has_prior_event(codelists.resp_cov, index_date)) #chronic respiratory disease
-    dataset.add_column(f"diabetes{var_name_suffix}", has_diabetes(index_date)) #diabetes
-    dataset.add_column(f"cld{var_name_suffix}", has_prior_event(codelists.cld, index_date)) # chronic liver disease
-    dataset.add_column(f"chd{var_name_suffix}", has_prior_event(codelists.chd_cov, index_date)) #chronic heart disease
-    dataset.add_column(f"cns{var_name_suffix}", has_prior_event(codelists.cns_cov, index_date)) # chronic neurological disease
-    dataset.add_column(f"asplenia{var_name_suffix}", has_prior_event(codelists.spln_cov, index_date)) # asplenia or dysfunction of the Spleen
-    dataset.add_column(f"learndis{var_name_suffix}", has_prior_event(codelists.learndis, index_date)) # learning Disability
-    dataset.add_column(f"smi{var_name_suffix}", has_smi(index_date)) #severe mental illness
-    dataset.add_column(f"severe_obesity{var_name_suffix}", has_severe_obesity(index_date)) # severe obesity
-    dataset.add_column(f"primis_atrisk{var_name_suffix}", primis_atrisk(index_date)) # at risk 
+# index_date can also be a list of dates, in which case one set of variables is added per date,
+# suffixed with "_0", "_1", ... (or with the corresponding element of var_name_suffix, if it is a list)
+# if packed is True, a single integer column primis_flags{var_name_suffix} is added per date
+# instead (see packed_primis_flags)
+# parameters is a PrimisParameters (see above), for sensitivity analyses
+def primis_variables(dataset, index_date, var_name_suffix="", packed=False, parameters=default_primis_parameters):
+    if isinstance(index_date, (list, tuple)):
+        if isinstance(var_name_suffix, (list, tuple)):
+            suffixes = var_name_suffix
+        else:
+            suffixes = [f"{var_name_suffix}_{i}" for i in range(len(index_date))]
+        for date, suffix in zip(index_date, suffixes, strict=True):
+            primis_variables(dataset, date, suffix, packed, parameters)
+        return
+    if packed:
+        dataset.add_column(f"primis_flags{var_name_suffix}", packed_primis_flags(index_date, parameters))
+        return
+    for name, flag in primis_flags(index_date, parameters).items():
+        dataset.add_column(f"{name}{var_name_suffix}", flag)
+
+## function to add the PRIMIS variables for several sets of parameters at once, for sensitivity analyses
+# parameter_sets maps a name to a PrimisParameters, and the variables for each set are suffixed with
+# "_{name}" (then "_0", "_1", ... if index_date is a list of dates), eg
+#   primis_sweep(dataset, index_date, {
+#       "default": PrimisParameters(),
+#       "bmi35": PrimisParameters(bmi_threshold=35.0),
+#       "immuno2y": PrimisParameters(immunosuppression_years=2),
+#   })
+# The codelist extraction (primis_summary) does not depend on the parameters, so it is shared by every
+# set, as are the conditions that no parameter affects (eg has_ckd): only the windows and thresholds
+# that differ are added to the query for each set.
+def primis_sweep(dataset, index_date, parameter_sets, packed=False):
+    for name, parameters in parameter_sets.items():
+        primis_variables(dataset, index_date, f"_{name}", packed, parameters)
@@ -0,0 +1,36 @@
+# import libraries
+from ehrql import (
+    create_dataset,
+)
+from ehrql.tables.tpp import (
+  patients,
+  practice_registrations, 
+)
+
+# import variable definitions
+from codelist_summary import *
+
+# initialise dataset
+dataset = create_dataset()
+dataset.configure_dummy_data(population_size=1000)
+
+# the summary in output/codelist-summary/dataset.arrow is for previous_index_date,
+# and is moved forward by a week
+previous_index_date = "2020-12-08"
+index_date = "2020-12-15"
+
+# define dataset population
+dataset.define_population(
+  practice_registrations.for_patient_on(index_date).exists_for_patient() &
+  ((patients.date_of_death> index_date) | patients.date_of_death.is_null())
+)
+
+# Advance the codelist summary to the new index date, reading only the events since the previous one.
+# The output has the same columns as the previous summary, so can be advanced again the following week.
+
+add_advanced_codelist_summaries(
+  dataset = dataset,
+  previous_summary = codelist_summary_table("output/codelist-summary/dataset.arrow"),
+  previous_index_date = previous_index_date,
+  index_date = index_date,
+)
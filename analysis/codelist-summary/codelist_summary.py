@@ -0,0 +1,132 @@
+# Read the codelist summary extracted by analysis/codelist-summary/dataset_definition.py,
+# so that variables can be derived from it rather than from clinical_events and medications.
+#
+# Copy this file, and summary_variables.py, into the analysis directory of a dataset definition, then eg:
+#
+#   summaries = summaries_from_file("output/codelist-summary/dataset.arrow")
+#   dataset.cld = summaries["cld"].exists
+#   dataset.ckd15_date = summaries["ckd15"].last_date
+#
+# Summaries are keyed by the names in codelists/codelists.txt (eg "addis_cod", "gdiab_cod",
+# "immunosuppression_admin_codes"). To key them by the names a project's codelists.py uses instead,
+# pass its {name: CSV path} dict, which is matched on the CSV path, eg for PRIMIS
+#   summaries = summaries_from_file("output/codelist-summary/dataset.arrow", codelists.codelist_files)
+#   summaries["addis"].exists
+#
+# A FileCodelistSummary only has exists / last_date / last_value / count (and first_date): it is not a
+# drop-in for the PRIMIS CodelistSummary, which also has where / window / windows / last, as the file
+# does not have the events those need. To use the file in the PRIMIS functions, pass the summaries to
+# use_primis_summary (in analysis/PRIMIS/variables_function.py), which reads exists / last_date /
+# last_value / count from the file and still reads the events for rules using windows. The summary
+# only describes events on or before the index date it was extracted for, so only use it for that date.
+
+
+
+#####################################################
+# Import relevant functions and scripts
+#####################################################
+
+import datetime
+
+from ehrql import case, codelist_from_csv, when
+from ehrql.tables import PatientFrame, Series, table_from_file
+
+from ehrql.tables.core import (
+  medications
+)
+
+from ehrql.tables.tpp import (
+  clinical_events
+)
+
+from summary_variables import medication_codelists, read_codelists_txt
+
+#####################################################
+# Define functions to read the codelist summary
+#####################################################
+
+# summary of one codelist, read from the codelist summary file
+class FileCodelistSummary:
+    def __init__(self, table, name):
+        self.first_date = getattr(table, f"{name}_first_date")
+        self.last_date = getattr(table, f"{name}_last_date")
+        self.count = getattr(table, f"{name}_count")
+        if name not in medication_codelists:
+            self.last_value = getattr(table, f"{name}_last_value")
+
+    @property
+    def exists(self):
+        return self.last_date.is_not_null()
+
+# patient table of the codelist summary file
+def codelist_summary_table(path):
+    columns = {}
+    for name in read_codelists_txt():
+        columns[f"{name}_first_date"] = Series(datetime.date)
+        columns[f"{name}_last_date"] = Series(datetime.date)
+        columns[f"{name}_count"] = Series(int)
+        if name not in medication_codelists:
+            columns[f"{name}_last_value"] = Series(float)
+    return table_from_file(path)(type("codelist_summary", (PatientFrame,), columns))
+
+# summaries of every codelist, keyed by name in codelists.txt, or by name in {codelist_files}
+# (a {name: CSV path} dict, eg codelists.codelist_files) if given
+def summaries_from_file(path, codelist_files=None):
+    table = codelist_summary_table(path)
+    codelists_txt = read_codelists_txt()
+    if codelist_files is None:
+        return {name: FileCodelistSummary(table, name) for name in codelists_txt}
+    names_by_path = {str(csv_path): name for name, csv_path in codelists_txt.items()}
+    missing = sorted(name for name, csv_path in codelist_files.items() if csv_path not in names_by_path)
+    if missing:
+        raise ValueError(f"Codelists not in codelists.txt, so not in the summary: {', '.join(missing)}")
+    return {
+        name: FileCodelistSummary(table, names_by_path[csv_path])
+        for name, csv_path in codelist_files.items()
+    }
+
+
+#####################################################
+# Define function to advance the codelist summary to a later index date
+#####################################################
+
+# Adds the same columns as add_codelist_summaries, for {index_date}, given the summary extracted for
+# {previous_index_date} (read with codelist_summary_table). Only events after {previous_index_date} are
+# read for patients in the previous summary, so eg a weekly update reads one week of events rather than
+# each patient's full history. Patients not in the previous summary (eg newly registered) are summarised
+# from their full history. The result matches a full recompute, except for events that were added to
+# the record after the previous extract but dated on or before {previous_index_date}.
+def add_advanced_codelist_summaries(dataset, previous_summary, previous_index_date, index_date):
+
+    in_previous_summary = previous_summary.exists_for_patient()
+
+    new_events = clinical_events.where(
+        clinical_events.date.is_on_or_before(index_date) &
+        (clinical_events.date.is_after(previous_index_date) | ~in_previous_summary)
+    )
+    new_meds = medications.where(
+        medications.date.is_on_or_before(index_date) &
+        (medications.date.is_after(previous_index_date) | ~in_previous_summary)
+    )
+
+    for name, path in read_codelists_txt().items():
+        codelist = codelist_from_csv(path, column="code")
+        if name in medication_codelists:
+            events = new_meds.where(new_meds.dmd_code.is_in(codelist))
+        else:
+            events = new_events.where(new_events.snomedct_code.is_in(codelist))
+        events = events.sort_by(events.date)
+        previous = FileCodelistSummary(previous_summary, name)
+        last_new_event = events.last_for_patient()
+
+        dataset.add_column(f"{name}_first_date", previous.first_date.when_null_then(events.first_for_patient().date))
+        dataset.add_column(f"{name}_last_date", last_new_event.date.when_null_then(previous.last_date))
+        dataset.add_column(f"{name}_count", previous.count.when_null_then(0) + events.count_for_patient())
+        if name not in medication_codelists:
+            dataset.add_column(
+                f"{name}_last_value",
+                case(
+                    when(last_new_event.date.is_not_null()).then(last_new_event.numeric_value),
+                    otherwise=previous.last_value,
+                )
+            )
@@ -0,0 +1,28 @@
+# import libraries
+from ehrql import (
+    create_dataset,
+)
+from ehrql.tables.tpp import (
+  patients,
+  practice_registrations, 
+)
+
+# import variable definitions
+from summary_variables import *
+
+# initialise dataset
+dataset = create_dataset()
+dataset.configure_dummy_data(population_size=1000)
+
+index_date = "2020-12-08"
+
+# define dataset population
+dataset.define_population(
+  practice_registrations.for_patient_on(index_date).exists_for_patient() &
+  ((patients.date_of_death> index_date) | patients.date_of_death.is_null())
+)
+
+# Summarise every codelist in codelists/codelists.txt, for use by other dataset definitions
+# (see codelist_summary.py)
+
+add_codelist_summaries(dataset = dataset, index_date = index_date)
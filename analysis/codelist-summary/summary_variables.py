@@ -0,0 +1,63 @@
+# These functions summarise, for every codelist in the project, each patient's events in that codelist.
+# The summary can be extracted once, by a single action, and read by other dataset definitions
+# (see codelist_summary.py) rather than each of them scanning clinical_events and medications again.
+
+
+
+#####################################################
+# Import relevant functions and scripts
+#####################################################
+
+import sys
+
+from ehrql import codelist_from_csv
+
+from ehrql.tables.core import (
+  medications
+)
+
+from ehrql.tables.tpp import (
+  clinical_events
+)
+
+# codelists.txt and the PRIMIS medication codelists are read by the same code as the tools in
+# analysis/tools, which needs only the standard library (paths are relative to the root of the repo,
+# as for the codelist CSVs)
+sys.path.append("analysis/tools")
+from codelist_index import read_codelists_txt, read_medication_codelists
+
+#####################################################
+# Codelists
+#####################################################
+
+# codelists of dm+d codes, which are queried in medications rather than clinical_events
+medication_codelists = read_medication_codelists()
+
+#####################################################
+# Define function to summarise events in each codelist
+#####################################################
+
+# adds {name}_first_date, {name}_last_date, {name}_count and (for clinical_events) {name}_last_value
+# for every codelist, counting events on or before {index_date}
+def add_codelist_summaries(dataset, index_date):
+
+    codelists = {
+        name: codelist_from_csv(path, column="code")
+        for name, path in read_codelists_txt().items()
+    }
+
+    prior_events = clinical_events.where(clinical_events.date.is_on_or_before(index_date))
+    prior_meds = medications.where(medications.date.is_on_or_before(index_date))
+
+    for name, codelist in codelists.items():
+        if name in medication_codelists:
+            events = prior_meds.where(prior_meds.dmd_code.is_in(codelist))
+        else:
+            events = prior_events.where(prior_events.snomedct_code.is_in(codelist))
+        events = events.sort_by(events.date)
+
+        dataset.add_column(f"{name}_first_date", events.first_for_patient().date)
+        dataset.add_column(f"{name}_last_date", events.last_for_patient().date)
+        dataset.add_column(f"{name}_count", events.count_for_patient())
+        if name not in medication_codelists:
+            dataset.add_column(f"{name}_last_value", events.last_for_patient().numeric_value)
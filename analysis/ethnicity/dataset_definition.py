@@ -6,11 +6,10 @@ from ehrql import (
 from ehrql.tables.tpp import (
   patients,
   practice_registrations, 
-  clinical_events
 )
 
-#Import codelists
-import codelists
+# import variable definitions
+from ethnicity_variables import *
 
 # initialise dataset
 dataset = create_dataset()
@@ -36,20 +35,11 @@ dataset.define_population(
 
 # For more information on ethnicity in OpenSAFELY, see https://doi.org/10.1186/s12916-024-03499-5
 
-ethnicity = (clinical_events
-  .where(clinical_events.snomedct_code.is_in(codelists.ethnicity16))
-  .sort_by(clinical_events.date)
-  .last_for_patient()
-)
-
 # EXAMPLE USAGE
 
-# ethnicity using 5 groups + unknown
-dataset.ethnicity5 = ethnicity.snomedct_code.to_category(codelists.ethnicity5)
-
-# ethnicity using 16 groups + unknown
-dataset.ethnicity16 = ethnicity.snomedct_code.to_category(codelists.ethnicity16)
-
-
-
-
+# adds:
+#   ethnicity5, ethnicity16: last ethnicity code across the entire record, using 5 / 16 groups + unknown
+#   ethnicity5_on_index, ethnicity16_on_index: last ethnicity code on or before index date
+#   ethnicity_on_index_default_date: whether the code behind ethnicity5_on_index / ethnicity16_on_index
+#     is dated 1900-01-01 (ie its date is unknown)
+add_ethnicity(dataset = dataset, index_date = index_date)
@@ -0,0 +1,54 @@
+# This function extracts ethnicity, from both the full record and the record up to a given date
+
+# For more information on ethnicity in OpenSAFELY, see https://doi.org/10.1186/s12916-024-03499-5
+
+
+
+#####################################################
+# Import relevant functions and scripts
+#####################################################
+
+from ehrql.tables.tpp import (
+  clinical_events
+)
+
+import codelists
+
+#####################################################
+# Define function to extract ethnicity
+#####################################################
+
+# Date that TPP records codes with no known date, eg ethnicity codes transferred from another practice
+DEFAULT_DATE = "1900-01-01"
+
+def add_ethnicity(dataset, index_date, var_name_suffix=""):
+
+    # all ethnicity codes, sorted by date. Both variants below are taken from this one sorted frame
+    ethnicity_events = (
+        clinical_events
+        .where(clinical_events.snomedct_code.is_in(codelists.ethnicity16))
+        .sort_by(clinical_events.date)
+    )
+
+    # last ethnicity code across the entire record (this looks into the future relative to {index_date})
+    ethnicity = ethnicity_events.last_for_patient()
+
+    # last ethnicity code recorded on or before {index_date}
+    ethnicity_on_index = (
+        ethnicity_events
+        .where(ethnicity_events.date.is_on_or_before(index_date))
+        .last_for_patient()
+    )
+
+    # ethnicity using 5 groups + unknown, and 16 groups + unknown
+    dataset.add_column(f"ethnicity5{var_name_suffix}", ethnicity.snomedct_code.to_category(codelists.ethnicity5))
+    dataset.add_column(f"ethnicity16{var_name_suffix}", ethnicity.snomedct_code.to_category(codelists.ethnicity16))
+    dataset.add_column(f"ethnicity5_on_index{var_name_suffix}", ethnicity_on_index.snomedct_code.to_category(codelists.ethnicity5))
+    dataset.add_column(f"ethnicity16_on_index{var_name_suffix}", ethnicity_on_index.snomedct_code.to_category(codelists.ethnicity16))
+
+    # whether the ethnicity on {index_date} comes from a code with the default date, so may have been
+    # recorded at any time (false for patients with no ethnicity code on or before {index_date})
+    dataset.add_column(
+        f"ethnicity_on_index_default_date{var_name_suffix}",
+        (ethnicity_on_index.date == DEFAULT_DATE).when_null_then(False)
+    )
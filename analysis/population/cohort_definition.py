@@ -0,0 +1,28 @@
+# import libraries
+from ehrql import (
+    create_dataset,
+)
+from ehrql.tables.tpp import (
+  patients,
+)
+
+# import variable definitions
+from population_variables import *
+
+# initialise dataset
+dataset = create_dataset()
+dataset.configure_dummy_data(population_size=1000)
+
+# EXAMPLE USAGE: a cohort of patients registered and alive on every one of several index dates,
+# using the population extracted by dataset_definition.py rather than extracting it again
+index_dates = ["2020-12-08", "2020-12-15", "2021-12-08"]
+
+# the columns to read: any of the index dates in output/population/dataset.arrow
+population = population_table("output/population/dataset.arrow", ["2020-01-01"] + index_dates)
+
+dataset.define_population(eligible_on_all(population, index_dates))
+
+# whether also registered and alive on an earlier date
+dataset.eligible_2020_01_01 = eligible_on(population, "2020-01-01")
+
+dataset.sex = patients.sex
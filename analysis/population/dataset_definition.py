@@ -0,0 +1,22 @@
+# import libraries
+from ehrql import (
+    create_dataset,
+)
+
+# import variable definitions
+from population_variables import *
+
+# initialise dataset
+dataset = create_dataset()
+dataset.configure_dummy_data(population_size=1000)
+
+# Choose the index dates: the index dates used by the other dataset definitions in this repo
+index_dates = ["2020-01-01", "2020-12-08", "2020-12-15", "2021-12-08"]
+
+# Extract the population (registered and alive) once for all of the index dates.
+# adds:
+#   eligible_2020_01_01, eligible_2020_12_08, ...: whether registered and alive on each index date
+# and includes patients eligible on at least one of the dates.
+# Other dataset definitions can read this with population_table, rather than extracting it again:
+# see cohort_definition.py.
+add_eligibility(dataset = dataset, index_dates = index_dates)
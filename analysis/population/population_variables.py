@@ -0,0 +1,78 @@
+# This function defines the standard study population on an index date: registered with a practice
+# and alive on that date, as used by each dataset definition in this repo.
+#
+# The population can also be extracted once for a list of index dates (see dataset_definition.py),
+# and read back by other dataset definitions with population_table, so that actions for the same
+# dates share one extraction rather than each evaluating the registration and death rules again.
+# Copy this file into the analysis directory of a dataset definition, then eg:
+#
+#   population = population_table("output/population/dataset.arrow", index_dates)
+#   dataset.define_population(eligible_on_all(population, index_dates))
+
+
+
+#####################################################
+# Import relevant functions and scripts
+#####################################################
+
+
+from ehrql.tables import PatientFrame, Series, table_from_file
+
+from ehrql.tables.tpp import (
+  patients,
+  practice_registrations,
+)
+
+#####################################################
+# Define functions to extract the population
+#####################################################
+
+# registered and alive on {index_date}
+def registered_and_alive(index_date):
+    return (
+        practice_registrations.for_patient_on(index_date).exists_for_patient() &
+        ((patients.date_of_death > index_date) | patients.date_of_death.is_null())
+    )
+
+# name of the eligibility column for {index_date}, eg "eligible_2020_12_08"
+def eligible_column(index_date):
+    return "eligible_" + str(index_date).replace("-", "_")
+
+# adds eligible_{index_date} (registered_and_alive) for each of {index_dates},
+# and defines the population as patients eligible on at least one of them
+def add_eligibility(dataset, index_dates):
+    population = None
+    for index_date in index_dates:
+        eligible = registered_and_alive(index_date)
+        dataset.add_column(eligible_column(index_date), eligible)
+        population = eligible if population is None else population | eligible
+    dataset.define_population(population)
+
+
+#####################################################
+# Define functions to read the population
+#####################################################
+
+# patient table of a previous add_eligibility output
+def population_table(path, index_dates):
+    columns = {eligible_column(index_date): Series(bool) for index_date in index_dates}
+    return table_from_file(path)(type("population", (PatientFrame,), columns))
+
+# eligible on {index_date}, from population_table; false for patients not in the file
+def eligible_on(population, index_date):
+    return getattr(population, eligible_column(index_date)).when_null_then(False)
+
+# eligible on every one of {index_dates} (eg for a cohort followed over several dates)
+def eligible_on_all(population, index_dates):
+    eligible = population.exists_for_patient()
+    for index_date in index_dates:
+        eligible = eligible & eligible_on(population, index_date)
+    return eligible
+
+# eligible on at least one of {index_dates}
+def eligible_on_any(population, index_dates):
+    eligible = None
+    for index_date in index_dates:
+        eligible_on_date = eligible_on(population, index_date)
+        eligible = eligible_on_date if eligible is None else eligible | eligible_on_date
+    return eligible
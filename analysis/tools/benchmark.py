@@ -0,0 +1,178 @@
+# Benchmark the dataset definitions and reusable variables in this repo, and check for regressions.
+#
+# For each population size, synthetic tables are generated (see dummy_tables.py, and reused if they
+# already exist) and each dataset definition is run against them (see run_local.py), recording:
+#   wall_time    seconds taken by `generate-dataset`
+#   peak_rss_mb  peak memory use of the `generate-dataset` process
+# Separately, the query plan for each definition and for selected variables is built in-process, recording:
+#   plan_nodes   number of distinct query model nodes
+#   build_time   seconds taken to build the query
+#
+# Results are written as JSON. If a baseline is given, any metric that has grown by more than its
+# threshold is reported and the script exits with an error. Everything runs offline.
+#
+# The number of rows scanned is not recorded: ehrQL's local query engine does not report it.
+# Memory is only meaningful when ehrQL is installed locally, rather than run via `opensafely exec`.
+#
+# Usage (from the root of the repo):
+#   python analysis/tools/benchmark.py --sizes 1000 10000 100000 --output output/benchmark/results.json
+#   python analysis/tools/benchmark.py --sizes 1000 10000 --baseline output/benchmark/baseline.json
+
+import argparse
+import datetime
+import importlib.util
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import dummy_tables
+from run_local import DEFINITIONS, generate_dataset_command, run_timed
+
+
+# maximum allowed increase on the baseline, as a proportion
+THRESHOLDS = {
+    "wall_time": 0.25,
+    "peak_rss_mb": 0.25,
+    "plan_nodes": 0.0,
+    "build_time": 0.5,
+}
+
+INDEX_DATE = "2020-12-08"
+
+
+#####################################################
+# Variables to benchmark
+#####################################################
+
+# each function returns the query model nodes for one variable (or set of variables)
+
+def primis_variable(function_name):
+    def build():
+        from query_plan import load_module
+        with load_module("analysis/PRIMIS", "variables_function") as variables_function:
+            variables_function.clear_primis_cache()
+            return [getattr(variables_function, function_name)(INDEX_DATE)._qm_node]
+    return build
+
+def vaccine_history(number_of_vaccines):
+    def build():
+        from ehrql import create_dataset
+        from query_plan import dataset_nodes, load_module
+        with load_module("analysis/vaccine-history", "vaccine_variables") as vaccine_variables:
+            dataset = create_dataset()
+            vaccine_variables.add_vaccine_history(
+                dataset=dataset, index_date=INDEX_DATE,
+                target_disease="SARS-2 Coronavirus", target_disease_short="covid",
+                number_of_vaccines=number_of_vaccines,
+            )
+            return list(dataset_nodes(dataset).values())
+    return build
+
+VARIABLES = {
+    "primis_atrisk": primis_variable("primis_atrisk"),
+    "has_severe_obesity": primis_variable("has_severe_obesity"),
+    "has_diabetes": primis_variable("has_diabetes"),
+    "is_immunosuppressed": primis_variable("is_immunosuppressed"),
+    "add_vaccine_history_10": vaccine_history(10),
+    "add_vaccine_history_20": vaccine_history(20),
+}
+
+
+#####################################################
+# Measurements
+#####################################################
+
+def ensure_tables(population_size, tables_root):
+    tables_dir = tables_root / str(population_size)
+    if not (tables_dir / "vaccinations.csv.gz").exists():
+        generator = dummy_tables.DummyTableGenerator(
+            codelists=dummy_tables.load_codelists(Path("codelists")),
+            prevalence={"default": 0.05},
+            seed="benchmark",
+            start_date=datetime.date(2015, 1, 1),
+            end_date=datetime.date(2025, 12, 31),
+            background_events=20.0,
+        )
+        dummy_tables.write_tables(generator, population_size, 100_000, tables_dir)
+    return tables_dir
+
+# wall time and peak memory of running a definition against local tables
+def run_definition(name, tables_dir, output_dir):
+    output = output_dir / f"{name}.arrow"
+    try:
+        return run_timed(generate_dataset_command(DEFINITIONS[name], tables_dir, output))
+    except subprocess.CalledProcessError:
+        raise RuntimeError(f"generate-dataset failed for {name}")
+
+# size of the query plan, and time taken to build it
+def measure_plan(build):
+    from query_plan import count_plan_nodes
+    start = time.perf_counter()
+    nodes = build()
+    build_time = time.perf_counter() - start
+    return {"plan_nodes": count_plan_nodes(*nodes), "build_time": build_time}
+
+def definition_plan(name):
+    def build():
+        from query_plan import dataset_nodes, load_definition
+        return list(dataset_nodes(load_definition(DEFINITIONS[name])["dataset"]).values())
+    return build
+
+def run_benchmarks(sizes, tables_root, output_dir):
+    results = {"runs": {}, "plans": {}}
+    for population_size in sizes:
+        tables_dir = ensure_tables(population_size, tables_root)
+        for name in DEFINITIONS:
+            results["runs"][f"{name}@{population_size}"] = run_definition(name, tables_dir, output_dir)
+    if importlib.util.find_spec("ehrql") is None:
+        print("ehrQL is not importable, so query plans are not measured", file=sys.stderr)
+        return results
+    for name in DEFINITIONS:
+        results["plans"][name] = measure_plan(definition_plan(name))
+    for name, build in VARIABLES.items():
+        results["plans"][name] = measure_plan(build)
+    return results
+
+
+#####################################################
+# Comparison with a baseline
+#####################################################
+
+def regressions(results, baseline):
+    found = []
+    for section, entries in baseline.items():
+        for name, metrics in entries.items():
+            for metric, baseline_value in metrics.items():
+                value = results.get(section, {}).get(name, {}).get(metric)
+                if value is None:
+                    continue
+                if value > baseline_value * (1 + THRESHOLDS[metric]):
+                    found.append(f"{name} {metric}: {baseline_value:.3g} -> {value:.3g}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10_000])
+    parser.add_argument("--tables-dir", type=Path, default=Path("dummy_tables/benchmark"))
+    parser.add_argument("--output", type=Path, default=Path("output/benchmark/results.json"))
+    parser.add_argument("--baseline", type=Path, help="results to compare against")
+    args = parser.parse_args()
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    results = run_benchmarks(args.sizes, args.tables_dir, args.output.parent)
+    args.output.write_text(json.dumps(results, indent=2))
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        found = regressions(results, json.loads(args.baseline.read_text()))
+        for regression in found:
+            print(f"Regression: {regression}")
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# Build a single index mapping every code in the project's codelists to the codelists it belongs to.
+#
+# Each codelist listed in codelists/codelists.txt is given a bit (in the order they are listed),
+# and each code is mapped to a bitmask of the codelists containing it. The index is written as
+# two parallel binary arrays, so that it can be memory-mapped and searched without parsing:
+#   codes.bin  sorted int64 codes
+#   masks.bin  uint64 bitmask for the code at the same position
+#   index.json codelist names (in bit order), code counts and the byte order of the arrays
+# A single lookup per event then gives membership of every codelist, rather than one `is_in` per codelist.
+#
+# The build also writes overlaps.csv, listing every pair of codelists that share codes.
+#
+# Usage (from the root of the repo):
+#   python analysis/tools/codelist_index.py --output-dir output/codelist-index
+
+import argparse
+import ast
+import bisect
+import csv
+import json
+import mmap
+import sys
+from array import array
+from pathlib import Path
+
+
+#####################################################
+# Build the index
+#####################################################
+
+VARIABLES_FUNCTION = Path("analysis/PRIMIS/variables_function.py")
+
+# codelist names and CSV paths, in the order listed in codelists.txt
+# eg "primis-covid19-vacc-uptake/ast/v2.5" is downloaded to "primis-covid19-vacc-uptake-ast.csv"
+# Names have "-" replaced by "_", so they can be used in column names (eg "immunosuppression_admin_codes").
+# This is also read by analysis/codelist-summary/summary_variables.py, so it must not need ehrQL.
+def read_codelists_txt(codelists_dir=Path("codelists")):
+    codelists_dir = Path(codelists_dir)
+    codelists = {}
+    for line in (codelists_dir / "codelists.txt").read_text().splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        organisation, name, _version = line.strip("/").split("/")
+        codelists[name.replace("-", "_")] = codelists_dir / f"{organisation}-{name}.csv"
+    return codelists
+
+# value of a top-level assignment in a python file (read without importing it, as it needs ehrQL)
+def read_assignment(path, name):
+    for node in ast.parse(Path(path).read_text()).body:
+        if isinstance(node, ast.Assign) and any(
+            isinstance(target, ast.Name) and target.id == name for target in node.targets
+        ):
+            return ast.literal_eval(node.value)
+    raise ValueError(f"No {name} in {path}")
+
+# names of the codelists of dm+d codes, which are queried in medications rather than clinical_events
+# (primis_meds_codelists in variables_function.py)
+def read_medication_codelists(path=VARIABLES_FUNCTION):
+    return read_assignment(path, "primis_meds_codelists")
+
+def read_codes(path, column="code"):
+    with open(path, newline="") as f:
+        return {int(row[column]) for row in csv.DictReader(f) if row[column].strip()}
+
+def build_index(codelists_dir, output_dir):
+    codelists = read_codelists_txt(codelists_dir)
+    if len(codelists) > 64:
+        raise ValueError(f"At most 64 codelists can be indexed, found {len(codelists)}")
+
+    codes_by_codelist = {name: read_codes(path) for name, path in codelists.items()}
+    masks = {}
+    for bit, codes in enumerate(codes_by_codelist.values()):
+        for code in codes:
+            masks[code] = masks.get(code, 0) | (1 << bit)
+    sorted_codes = sorted(masks)
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with open(output_dir / "codes.bin", "wb") as f:
+        array("q", sorted_codes).tofile(f)
+    with open(output_dir / "masks.bin", "wb") as f:
+        array("Q", (masks[code] for code in sorted_codes)).tofile(f)
+    header = {
+        "codelists": list(codelists),
+        "code_counts": {name: len(codes) for name, codes in codes_by_codelist.items()},
+        "number_of_codes": len(sorted_codes),
+        "byteorder": sys.byteorder,
+    }
+    (output_dir / "index.json").write_text(json.dumps(header, indent=2))
+
+    write_overlaps(codes_by_codelist, output_dir / "overlaps.csv")
+    return header
+
+# pairs of codelists sharing at least one code, and whether one is contained in the other
+def write_overlaps(codes_by_codelist, path):
+    names = list(codes_by_codelist)
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["codelist_a", "codelist_b", "codes_a", "codes_b", "shared", "a_in_b", "b_in_a"])
+        for i, name_a in enumerate(names):
+            for name_b in names[i + 1:]:
+                codes_a, codes_b = codes_by_codelist[name_a], codes_by_codelist[name_b]
+                shared = len(codes_a & codes_b)
+                if shared:
+                    writer.writerow([
+                        name_a, name_b, len(codes_a), len(codes_b), shared,
+                        shared == len(codes_a), shared == len(codes_b),
+                    ])
+
+
+#####################################################
+# Load and query the index
+#####################################################
+
+# memory-mapped codelist index, eg
+#   index = CodelistIndex("output/codelist-index")
+#   index.codelists_for(code)             -> ["ckd15", "ckd35"]
+#   index.mask(code) & index.bit("ckd35") -> non-zero if code is in ckd35
+class CodelistIndex:
+    def __init__(self, directory):
+        directory = Path(directory)
+        header = json.loads((directory / "index.json").read_text())
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError(f"Index was built on a {header['byteorder']}-endian machine")
+        self.codelists = header["codelists"]
+        self.code_counts = header["code_counts"]
+        self.codes = self._map(directory / "codes.bin", "q")
+        self.masks = self._map(directory / "masks.bin", "Q")
+
+    @staticmethod
+    def _map(path, typecode):
+        with open(path, "rb") as f:
+            return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)).cast(typecode)
+
+    def bit(self, name):
+        return 1 << self.codelists.index(name)
+
+    # bitmask of codelists containing code (0 if it is in none of them)
+    def mask(self, code):
+        code = int(code)
+        position = bisect.bisect_left(self.codes, code)
+        if position < len(self.codes) and self.codes[position] == code:
+            return self.masks[position]
+        return 0
+
+    def masks_for(self, codes):
+        return [self.mask(code) for code in codes]
+
+    def codelists_for(self, code):
+        mask = self.mask(code)
+        return [name for bit, name in enumerate(self.codelists) if mask & (1 << bit)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--codelists-dir", type=Path, default=Path("codelists"))
+    parser.add_argument("--output-dir", type=Path, default=Path("output/codelist-index"))
+    args = parser.parse_args()
+    header = build_index(args.codelists_dir, args.output_dir)
+    print(
+        f"Indexed {header['number_of_codes']} codes from {len(header['codelists'])} codelists "
+        f"to {args.output_dir}"
+    )
+
+
+if __name__ == "__main__":
+    main()
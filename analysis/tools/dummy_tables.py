@@ -0,0 +1,227 @@
+# Generate synthetic event tables, for benchmarking and checking the variables in this repo at scale.
+#
+# `configure_dummy_data` generates a small, random population that rarely matches the project's
+# codelists. This script instead generates the tables used by the dataset definitions, drawing codes
+# from the codelists in codelists/ so that a configurable proportion of patients has each condition:
+#   patients, practice_registrations, clinical_events, medications, vaccinations
+#
+# Tables are written in ehrQL's local table format (one gzipped CSV per table), so they can be used
+# with `--dummy-tables` (see run_local.py). Patients are generated in chunks and rows are streamed
+# straight to the output files, so memory use does not depend on the population size.
+# Output is deterministic for a given seed, population size and chunk size.
+#
+# Usage (from the root of the repo):
+#   python analysis/tools/dummy_tables.py --population-size 100000 --output-dir dummy_tables
+#   python analysis/tools/dummy_tables.py --population-size 100000 --prevalence 0.1 --prevalence-for ast=0.2
+
+import argparse
+import csv
+import datetime
+import gzip
+import math
+from contextlib import ExitStack
+from pathlib import Path
+from random import Random
+
+from codelist_index import read_codelists_txt, read_codes, read_medication_codelists
+
+
+TABLES = {
+    "patients": ["patient_id", "date_of_birth", "sex", "date_of_death"],
+    "practice_registrations": ["patient_id", "start_date", "end_date", "practice_pseudo_id"],
+    "clinical_events": ["patient_id", "date", "snomedct_code", "numeric_value"],
+    "medications": ["patient_id", "date", "dmd_code"],
+    "vaccinations": ["patient_id", "vaccination_id", "date", "target_disease", "product_name"],
+}
+
+# codelists of dm+d codes, which are recorded in medications rather than clinical_events
+MEDICATION_CODELISTS = set(read_medication_codelists())
+
+# ethnicity is recorded for most patients, and sometimes on TPP's default date
+ETHNICITY_CODELIST = "ethnicity_snomed_0removed"
+ETHNICITY_PREVALENCE = 0.8
+DEFAULT_DATE = datetime.date(1900, 1, 1)
+
+# codelists recorded with a numeric value, and the (mean, sd) of that value
+NUMERIC_VALUES = {"bmi": (28.0, 7.0)}
+
+# target disease: (product names, chance of a dose each year, first year offered)
+VACCINES = {
+    "SARS-2 Coronavirus": (
+        ["COVID-19 mRNA Vaccine Comirnaty 30micrograms/0.3ml dose conc for susp for inj MDV (Pfizer)",
+         "COVID-19 Vaccine Vaxzevria 0.5ml inj multidose vials (AstraZeneca)",
+         "COVID-19 mRNA Vaccine Spikevax (nucleoside modified) 0.1mg/0.5mL dose disp for inj MDV (Moderna)"],
+        0.6, 2020,
+    ),
+    "Influenza": (
+        ["Fluenz Tetra vaccine nasal suspension 0.2ml unit dose (AstraZeneca UK Ltd)",
+         "Adjuvanted trivalent influenza vaccine (surface antigen, inactivated) suspension for injection 0.5ml pre-filled syringes (Seqirus UK Ltd)"],
+        0.5, 2000,
+    ),
+    "Pneumococcal": (
+        ["Pneumovax 23 vaccine solution for injection 0.5ml pre-filled syringes (Merck Sharp & Dohme (UK) Ltd)"],
+        0.02, 2000,
+    ),
+}
+
+SEXES = ["female", "male", "intersex", "unknown"]
+SEX_WEIGHTS = [0.5, 0.49, 0.005, 0.005]
+
+
+def random_date(rng, start, end):
+    return start + datetime.timedelta(days=rng.randint(0, max((end - start).days, 0)))
+
+# number of events for a patient with a condition: heavy-tailed, with a median of ~2 and a long tail
+def event_count(rng, median=2.0):
+    return max(1, round(rng.lognormvariate(math.log(median), 1.0)))
+
+
+class DummyTableGenerator:
+    def __init__(self, codelists, prevalence, seed, start_date, end_date, background_events):
+        self.codelists = codelists
+        self.prevalence = prevalence
+        self.seed = seed
+        self.start_date = start_date
+        self.end_date = end_date
+        self.background_events = background_events
+        self.all_codes = {code for codes in codelists.values() for code in codes}
+        self.vaccination_id = 0
+
+    # rows for patients first_id, ..., last_id, as {table name: [row, ...]}
+    def generate_chunk(self, chunk_number, first_id, last_id):
+        rng = Random(f"{self.seed}-{chunk_number}")
+        rows = {name: [] for name in TABLES}
+        for patient_id in range(first_id, last_id + 1):
+            self.add_patient(rng, patient_id, rows)
+        return rows
+
+    def add_patient(self, rng, patient_id, rows):
+        date_of_birth = random_date(rng, datetime.date(1920, 1, 1), self.end_date).replace(day=1)
+        date_of_death = None
+        if rng.random() < 0.05:
+            date_of_death = random_date(rng, max(date_of_birth, self.start_date), self.end_date)
+        last_date = date_of_death or self.end_date
+        rows["patients"].append(
+            [patient_id, date_of_birth, rng.choices(SEXES, SEX_WEIGHTS)[0], date_of_death]
+        )
+
+        registration_start = random_date(rng, date_of_birth, last_date)
+        registration_end = random_date(rng, registration_start, last_date) if rng.random() < 0.1 else None
+        rows["practice_registrations"].append(
+            [patient_id, registration_start, registration_end, rng.randint(1, 1000)]
+        )
+
+        for name, codes in self.codelists.items():
+            if name == ETHNICITY_CODELIST:
+                self.add_ethnicity(rng, patient_id, codes, date_of_birth, last_date, rows)
+            elif rng.random() < self.prevalence.get(name, self.prevalence["default"]):
+                self.add_codelist_events(rng, patient_id, name, codes, date_of_birth, last_date, rows)
+
+        # events not in any codelist, so filters have a realistic amount of data to discard
+        for _ in range(event_count(rng, self.background_events)):
+            code = str(rng.randint(10**8, 10**9 - 1))
+            if code not in self.all_codes:
+                rows["clinical_events"].append([patient_id, random_date(rng, date_of_birth, last_date), code, None])
+
+        self.add_vaccinations(rng, patient_id, date_of_birth, last_date, rows)
+
+    def add_codelist_events(self, rng, patient_id, name, codes, date_of_birth, last_date, rows):
+        for _ in range(event_count(rng)):
+            date = random_date(rng, date_of_birth, last_date)
+            code = rng.choice(codes)
+            if name in MEDICATION_CODELISTS:
+                rows["medications"].append([patient_id, date, code])
+            else:
+                value = None
+                if name in NUMERIC_VALUES:
+                    value = round(rng.gauss(*NUMERIC_VALUES[name]), 1)
+                rows["clinical_events"].append([patient_id, date, code, value])
+
+    def add_ethnicity(self, rng, patient_id, codes, date_of_birth, last_date, rows):
+        if rng.random() >= ETHNICITY_PREVALENCE:
+            return
+        for _ in range(rng.choice([1, 1, 1, 2])):
+            date = DEFAULT_DATE if rng.random() < 0.1 else random_date(rng, date_of_birth, last_date)
+            rows["clinical_events"].append([patient_id, date, rng.choice(codes), None])
+
+    def add_vaccinations(self, rng, patient_id, date_of_birth, last_date, rows):
+        for target_disease, (products, chance, first_year) in VACCINES.items():
+            for year in range(max(first_year, date_of_birth.year + 1), last_date.year + 1):
+                if rng.random() >= chance:
+                    continue
+                date = random_date(
+                    rng, datetime.date(year, 1, 1), min(datetime.date(year, 12, 31), last_date)
+                )
+                # occasionally a dose is recorded twice on the same day
+                for _ in range(2 if rng.random() < 0.01 else 1):
+                    self.vaccination_id += 1
+                    rows["vaccinations"].append(
+                        [patient_id, self.vaccination_id, date, target_disease, rng.choice(products)]
+                    )
+
+
+def write_tables(generator, population_size, chunk_size, output_dir):
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with ExitStack() as stack:
+        writers = {}
+        for name, columns in TABLES.items():
+            f = stack.enter_context(gzip.open(output_dir / f"{name}.csv.gz", "wt", newline=""))
+            writers[name] = csv.writer(f)
+            writers[name].writerow(columns)
+        for chunk_number, first_id in enumerate(range(1, population_size + 1, chunk_size)):
+            last_id = min(first_id + chunk_size - 1, population_size)
+            for name, rows in generator.generate_chunk(chunk_number, first_id, last_id).items():
+                writers[name].writerows(rows)
+            print(f"Generated patients {first_id}-{last_id}")
+
+
+# codes in each codelist, as {name: [code, ...]}
+def load_codelists(codelists_dir):
+    return {
+        name: sorted(str(code) for code in read_codes(path))
+        for name, path in read_codelists_txt(codelists_dir).items()
+    }
+
+
+def parse_prevalence(value):
+    name, _, prevalence = value.partition("=")
+    return name, float(prevalence)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--population-size", type=int, required=True)
+    parser.add_argument("--output-dir", type=Path, default=Path("dummy_tables"))
+    parser.add_argument("--codelists-dir", type=Path, default=Path("codelists"))
+    parser.add_argument("--seed", default="0")
+    parser.add_argument("--chunk-size", type=int, default=100_000)
+    parser.add_argument(
+        "--prevalence", type=float, default=0.05,
+        help="proportion of patients with events in each codelist",
+    )
+    parser.add_argument(
+        "--prevalence-for", type=parse_prevalence, action="append", default=[],
+        metavar="CODELIST=PREVALENCE", help="override the prevalence for one codelist",
+    )
+    parser.add_argument(
+        "--background-events", type=float, default=20.0,
+        help="median number of events per patient not in any codelist",
+    )
+    parser.add_argument("--start-date", type=datetime.date.fromisoformat, default=datetime.date(2015, 1, 1))
+    parser.add_argument("--end-date", type=datetime.date.fromisoformat, default=datetime.date(2025, 12, 31))
+    args = parser.parse_args()
+
+    codelists = load_codelists(args.codelists_dir)
+    generator = DummyTableGenerator(
+        codelists=codelists,
+        prevalence={"default": args.prevalence, **dict(args.prevalence_for)},
+        seed=args.seed,
+        start_date=args.start_date,
+        end_date=args.end_date,
+        background_events=args.background_events,
+    )
+    write_tables(generator, args.population_size, args.chunk_size, args.output_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+# A memory-mapped store of each patient's events, for answering "last event in a codelist on or
+# before a date" for many patients and dates at once.
+#
+# has_prior_event / last_prior_event (and the _meds versions) in analysis/PRIMIS/variables_function.py
+# all ask the same question of clinical_events or medications. This script builds an on-disk store
+# of the clinical_events, medications and vaccinations tables from a directory of local tables
+# (see dummy_tables.py), with each table in CSR layout:
+#   patient_ids.bin  sorted int64 patient ids
+#   offsets.bin      int64 offsets: patient i's events are rows offsets[i] to offsets[i + 1] - 1
+#   dates.bin        int32 days since 1970-01-01, sorted within each patient
+#   codes.bin        int64 code (snomedct_code, dmd_code, or for vaccinations an index into the
+#                    target_disease values in store.json)
+#   values.bin       float64 numeric_value (NaN if missing), clinical_events only
+#   products.bin     int32 index into the product_name values in store.json, vaccinations only
+# The files are memory-mapped, so opening a store reads nothing but store.json, and lookups only
+# touch the pages they need.
+#
+# The store is built in two passes over each table, so memory use depends on the number of
+# patients rather than the number of events: the first counts each patient's events, the second
+# writes each event into its patient's rows, and each patient's rows are then sorted by date.
+# Events with no date are left out, as they are never on or before any date.
+#
+# Lookups are batched: `where_codes` finds the events in a codelist with one pass over the codes
+# column, and each (patient, date) lookup is then a binary search within that patient's events.
+# The functions at the bottom of this file mirror the general functions in variables_function.py,
+# for checking and exploring them outside ehrQL. Dataset definitions still use ehrQL.
+#
+# Usage (from the root of the repo):
+#   python analysis/tools/event_store.py build dummy_tables output/event-store
+#   python analysis/tools/event_store.py query output/event-store clinical_events ckd15 output/event-store/ckd15.csv \
+#       --dates 2021-01-01 2022-01-01
+
+import argparse
+import bisect
+import csv
+import datetime
+import gzip
+import json
+import math
+import mmap
+import sys
+from array import array
+from pathlib import Path
+
+from codelist_index import read_codelists_txt, read_codes
+
+
+EPOCH = datetime.date(1970, 1, 1)
+
+# table: (code column, whether it has numeric_value, whether codes are strings stored by index)
+TABLES = {
+    "clinical_events": ("snomedct_code", True, False),
+    "medications": ("dmd_code", False, False),
+    "vaccinations": ("target_disease", False, True),
+}
+
+# column: array typecode
+COLUMNS = {
+    "patient_ids": "q",
+    "offsets": "q",
+    "dates": "i",
+    "codes": "q",
+    "values": "d",
+    "products": "i",
+}
+
+
+def to_days(date):
+    if isinstance(date, str):
+        date = datetime.date.fromisoformat(date)
+    return (date - EPOCH).days
+
+def from_days(days):
+    return EPOCH + datetime.timedelta(days=days)
+
+def open_table(path):
+    return gzip.open(path, "rt", newline="") if path.suffix == ".gz" else open(path, newline="")
+
+def table_path(tables_dir, name):
+    for suffix in (".csv.gz", ".csv"):
+        path = Path(tables_dir) / f"{name}{suffix}"
+        if path.exists():
+            return path
+    return None
+
+
+#####################################################
+# Build the store
+#####################################################
+
+# a column file of a fixed number of values, written in place through a memory map
+class ColumnWriter:
+    def __init__(self, path, typecode, length):
+        self.itemsize = array(typecode).itemsize
+        with open(path, "wb") as f:
+            f.truncate(length * self.itemsize)
+        self.file = open(path, "r+b")
+        self.map = mmap.mmap(self.file.fileno(), 0) if length else None
+        self.values = memoryview(self.map).cast(typecode) if length else memoryview(array(typecode))
+
+    def close(self):
+        self.values.release()
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+def build_table(path, name, output_dir):
+    code_column, has_values, string_codes = TABLES[name]
+    output_dir.mkdir(parents=True, exist_ok=True)
+    dictionaries = {"codes": [], "products": []}
+    indexes = {"codes": {}, "products": {}}
+
+    def dictionary_index(column, value):
+        if value not in indexes[column]:
+            indexes[column][value] = len(dictionaries[column])
+            dictionaries[column].append(value)
+        return indexes[column][value]
+
+    # first pass: number of events for each patient
+    counts = {}
+    with open_table(path) as f:
+        for row in csv.DictReader(f):
+            if row["date"]:
+                patient_id = int(row["patient_id"])
+                counts[patient_id] = counts.get(patient_id, 0) + 1
+    patient_ids = sorted(counts)
+    offsets = array("q", [0])
+    for patient_id in patient_ids:
+        offsets.append(offsets[-1] + counts[patient_id])
+    with open(output_dir / "patient_ids.bin", "wb") as f:
+        array("q", patient_ids).tofile(f)
+    with open(output_dir / "offsets.bin", "wb") as f:
+        offsets.tofile(f)
+    number_of_events = offsets[-1]
+
+    # second pass: write each event into the next free row of its patient
+    columns = ["dates", "codes"] + (["values"] if has_values else []) + (["products"] if name == "vaccinations" else [])
+    writers = {column: ColumnWriter(output_dir / f"{column}.bin", COLUMNS[column], number_of_events) for column in columns}
+    next_row = {patient_id: offsets[i] for i, patient_id in enumerate(patient_ids)}
+    with open_table(path) as f:
+        for row in csv.DictReader(f):
+            if not row["date"]:
+                continue
+            patient_id = int(row["patient_id"])
+            i = next_row[patient_id]
+            next_row[patient_id] += 1
+            writers["dates"].values[i] = to_days(row["date"])
+            code = row[code_column]
+            writers["codes"].values[i] = dictionary_index("codes", code) if string_codes else int(code)
+            if has_values:
+                writers["values"].values[i] = float(row["numeric_value"]) if row["numeric_value"] else math.nan
+            if name == "vaccinations":
+                writers["products"].values[i] = dictionary_index("products", row["product_name"])
+
+    # sort each patient's events by date (keeping their order within a date)
+    for start, end in zip(offsets, offsets[1:]):
+        order = sorted(range(start, end), key=lambda i: writers["dates"].values[i])
+        if order != list(range(start, end)):
+            for writer in writers.values():
+                writer.values[start:end] = array(writer.values.format, [writer.values[i] for i in order])
+    for writer in writers.values():
+        writer.close()
+
+    return {
+        "patients": len(patient_ids),
+        "events": number_of_events,
+        "columns": columns,
+        "codes": dictionaries["codes"] if string_codes else None,
+        "products": dictionaries["products"] if name == "vaccinations" else None,
+    }
+
+def build_store(tables_dir, output_dir):
+    header = {"byteorder": sys.byteorder, "tables": {}}
+    for name in TABLES:
+        path = table_path(tables_dir, name)
+        if path is not None:
+            header["tables"][name] = build_table(path, name, Path(output_dir) / name)
+    (Path(output_dir) / "store.json").write_text(json.dumps(header, indent=2))
+    return header
+
+
+#####################################################
+# Load and query the store
+#####################################################
+
+def _map(path, typecode):
+    with open(path, "rb") as f:
+        if f.seek(0, 2) == 0:
+            return memoryview(array(typecode))
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)).cast(typecode)
+
+# memory-mapped events for one table, eg
+#   store = EventStore("output/event-store")
+#   ckd15 = store["clinical_events"].where_codes(codelist_codes)
+#   ckd15.last_on_or_before([1, 2, 3], [date(2021, 1, 1), date(2022, 1, 1)])
+class EventTable:
+    def __init__(self, directory, header):
+        self.columns = {
+            column: _map(directory / f"{column}.bin", COLUMNS[column])
+            for column in ["patient_ids", "offsets"] + header["columns"]
+        }
+        self.patient_ids = self.columns["patient_ids"]
+        self.offsets = self.columns["offsets"]
+        self.dates = self.columns["dates"]
+        self.codes = self.columns["codes"]
+        self.code_values = header["codes"]
+        self.product_values = header["products"]
+
+    # rows of a patient's events, as a range
+    def rows(self, patient_id):
+        i = bisect.bisect_left(self.patient_ids, patient_id)
+        if i < len(self.patient_ids) and self.patient_ids[i] == patient_id:
+            return range(self.offsets[i], self.offsets[i + 1])
+        return range(0)
+
+    # the events with a code in codes (eg a codelist), as a CodelistEvents
+    def where_codes(self, codes):
+        if self.code_values is not None:
+            codes = {self.code_values.index(code) for code in codes if code in self.code_values}
+        else:
+            codes = {int(code) for code in codes}
+        rows = array("q")
+        offsets = array("q", [0])
+        for start, end in zip(self.offsets, self.offsets[1:]):
+            rows.extend(i for i in range(start, end) if self.codes[i] in codes)
+            offsets.append(len(rows))
+        return CodelistEvents(self, rows, offsets)
+
+    # an event as a dict of its columns
+    def event(self, row):
+        event = {"date": from_days(self.dates[row])}
+        code = self.codes[row]
+        event["code"] = self.code_values[code] if self.code_values is not None else code
+        if "values" in self.columns:
+            value = self.columns["values"][row]
+            event["numeric_value"] = None if math.isnan(value) else value
+        if "products" in self.columns:
+            event["product_name"] = self.product_values[self.columns["products"][row]]
+        return event
+
+# the events in a table matching a codelist, with the same CSR layout over positions in the table
+class CodelistEvents:
+    def __init__(self, table, rows, offsets):
+        self.table = table
+        self.rows = rows
+        self.offsets = offsets
+        self.dates = array("i", (table.dates[row] for row in rows))
+
+    def _bounds(self, patient_id):
+        i = bisect.bisect_left(self.table.patient_ids, patient_id)
+        if i < len(self.table.patient_ids) and self.table.patient_ids[i] == patient_id:
+            return self.offsets[i], self.offsets[i + 1]
+        return 0, 0
+
+    # {patient_id: [row of the last event on or before each date, or None]}
+    def last_rows_on_or_before(self, patient_ids, dates):
+        days = [to_days(date) for date in dates]
+        results = {}
+        for patient_id in sorted(patient_ids):
+            start, end = self._bounds(patient_id)
+            rows = []
+            for day in days:
+                i = bisect.bisect_right(self.dates, day, start, end)
+                rows.append(self.rows[i - 1] if i > start else None)
+            results[patient_id] = rows
+        return results
+
+    # {patient_id: [last event on or before each date (as a dict), or None]}
+    def last_on_or_before(self, patient_ids, dates):
+        return {
+            patient_id: [None if row is None else self.table.event(row) for row in rows]
+            for patient_id, rows in self.last_rows_on_or_before(patient_ids, dates).items()
+        }
+
+    # {patient_id: [whether there is an event on or before each date]}
+    def exists_on_or_before(self, patient_ids, dates):
+        return {
+            patient_id: [row is not None for row in rows]
+            for patient_id, rows in self.last_rows_on_or_before(patient_ids, dates).items()
+        }
+
+class EventStore:
+    def __init__(self, directory):
+        directory = Path(directory)
+        header = json.loads((directory / "store.json").read_text())
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError(f"Store was built on a {header['byteorder']}-endian machine")
+        self.tables = {
+            name: EventTable(directory / name, table_header)
+            for name, table_header in header["tables"].items()
+        }
+
+    def __getitem__(self, name):
+        return self.tables[name]
+
+
+#####################################################
+# General functions, as in variables_function.py
+#####################################################
+
+# each takes a list of patient ids and a list of index dates, and returns
+# {patient_id: [value on each index date]}
+
+def has_prior_event(store, codelist, patient_ids, index_dates):
+    return store["clinical_events"].where_codes(codelist).exists_on_or_before(patient_ids, index_dates)
+
+def last_prior_event(store, codelist, patient_ids, index_dates):
+    return store["clinical_events"].where_codes(codelist).last_on_or_before(patient_ids, index_dates)
+
+def has_prior_meds(store, codelist, patient_ids, index_dates):
+    return store["medications"].where_codes(codelist).exists_on_or_before(patient_ids, index_dates)
+
+def last_prior_meds(store, codelist, patient_ids, index_dates):
+    return store["medications"].where_codes(codelist).last_on_or_before(patient_ids, index_dates)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="build a store from a directory of local tables")
+    build_parser.add_argument("tables_dir", type=Path)
+    build_parser.add_argument("output_dir", type=Path)
+    query_parser = subparsers.add_parser(
+        "query", help="write the date of each patient's last event in a codelist on or before each date"
+    )
+    query_parser.add_argument("store", type=Path)
+    query_parser.add_argument("table", choices=list(TABLES))
+    query_parser.add_argument(
+        "codelist", help="codelist name, as in codelists/codelists.txt (or for vaccinations, a target disease)"
+    )
+    query_parser.add_argument("output", type=Path)
+    query_parser.add_argument("--dates", type=datetime.date.fromisoformat, nargs="+", required=True)
+    query_parser.add_argument("--codelists-dir", type=Path, default=Path("codelists"))
+    args = parser.parse_args()
+
+    if args.command == "build":
+        header = build_store(args.tables_dir, args.output_dir)
+        for name, table in header["tables"].items():
+            print(f"{name}: {table['events']} events for {table['patients']} patients")
+    elif args.command == "query":
+        table = EventStore(args.store)[args.table]
+        if args.table == "vaccinations":
+            codes = [args.codelist]
+        else:
+            codes = read_codes(read_codelists_txt(args.codelists_dir)[args.codelist])
+        results = table.where_codes(codes).last_rows_on_or_before(table.patient_ids, args.dates)
+        with open(args.output, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["patient_id"] + [f"last_date_{i}" for i in range(len(args.dates))])
+            for patient_id, rows in results.items():
+                writer.writerow([patient_id] + [
+                    "" if row is None else from_days(table.dates[row]) for row in rows
+                ])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# Number the doses in a long-format vaccine history, and optionally pivot it back to wide format.
+#
+# analysis/vaccine-history/long_definition.py writes one row per vaccination event
+# (patient_id, target_disease, date, product_name). This script streams through those events,
+# one patient at a time, and either:
+#   --long: writes (patient_id, target_disease, dose_number, date, product_name)
+#   --wide: writes the vax_{short}_{i}_date / vax_{short}_{i}_type columns of add_vaccine_history,
+#           for analyses that expect them
+# As in add_vaccine_history, doses are numbered in date order, and of several vaccinations for the same
+# disease on the same day only the first is kept.
+#
+# Usage (from the root of the repo):
+#   python analysis/tools/pivot_vaccine_history.py output/vaccine-history-long --long output/vaccine-history-long/doses.csv.gz
+#   python analysis/tools/pivot_vaccine_history.py output/vaccine-history-long --wide output/vaccine-history-long/wide.csv.gz \
+#       --disease "SARS-2 Coronavirus=covid" --disease Influenza=flu --number-of-vaccines 10
+
+import argparse
+import csv
+import itertools
+from pathlib import Path
+
+from read_output import open_output, read_rows
+
+
+#####################################################
+# Reading events
+#####################################################
+
+# (patient_id, [row, ...]) for each patient, checking that rows are in patient order
+# (write_wide relies on this to match events to the patients in the dataset table)
+def rows_by_patient(rows):
+    previous_id = None
+    for patient_id, patient_rows in itertools.groupby(rows, key=lambda row: int(row["patient_id"])):
+        if previous_id is not None and patient_id < previous_id:
+            raise ValueError(f"Rows are not in patient order: patient {patient_id} after {previous_id}")
+        previous_id = patient_id
+        yield patient_id, list(patient_rows)
+
+# one patient's doses, as (target_disease, dose_number, date, product_name)
+def number_doses(patient_rows):
+    doses = []
+    by_disease = sorted(patient_rows, key=lambda row: row["target_disease"])
+    for target_disease, rows in itertools.groupby(by_disease, key=lambda row: row["target_disease"]):
+        dose_number = 0
+        previous_date = None
+        for row in sorted(rows, key=lambda row: str(row["date"])):
+            date = str(row["date"])
+            if date == previous_date:
+                continue
+            dose_number += 1
+            previous_date = date
+            doses.append((target_disease, dose_number, date, row["product_name"]))
+    return doses
+
+
+#####################################################
+# Writing doses
+#####################################################
+
+def write_long(directory, output, table_name="vaccinations"):
+    with open_output(output) as f:
+        writer = csv.writer(f)
+        writer.writerow(["patient_id", "target_disease", "dose_number", "date", "product_name"])
+        for patient_id, patient_rows in rows_by_patient(read_rows(directory, table_name)):
+            for dose in number_doses(patient_rows):
+                writer.writerow([patient_id, *dose])
+
+# diseases maps each target disease to its short name, as for add_vaccine_histories
+def write_wide(directory, output, diseases, number_of_vaccines, table_name="vaccinations"):
+    columns = ["patient_id"]
+    for short in diseases.values():
+        for i in range(1, number_of_vaccines + 1):
+            columns += [f"vax_{short}_{i}_date", f"vax_{short}_{i}_type"]
+
+    events = rows_by_patient(read_rows(directory, table_name))
+    # patients with no vaccinations only appear in the patient-level dataset table, if there is one
+    patient_ids = None
+    if any(Path(directory, f"dataset{suffix}").exists() for suffix in (".arrow", ".csv.gz", ".csv")):
+        patient_ids = (int(row["patient_id"]) for row in read_rows(directory, "dataset"))
+
+    with open_output(output) as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        next_event = next(events, None)
+        for patient_id in patient_ids if patient_ids is not None else itertools.count():
+            if patient_ids is None:
+                if next_event is None:
+                    break
+                patient_id = next_event[0]
+            while next_event is not None and next_event[0] < patient_id:
+                next_event = next(events, None)
+            row = dict.fromkeys(columns, "")
+            row["patient_id"] = patient_id
+            if next_event is not None and next_event[0] == patient_id:
+                for target_disease, dose_number, date, product_name in number_doses(next_event[1]):
+                    if target_disease in diseases and dose_number <= number_of_vaccines:
+                        row[f"vax_{diseases[target_disease]}_{dose_number}_date"] = date
+                        row[f"vax_{diseases[target_disease]}_{dose_number}_type"] = product_name
+                next_event = next(events, None)
+            writer.writerow(row.values())
+
+
+def parse_disease(value):
+    target_disease, _, short = value.rpartition("=")
+    return target_disease, short
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory", type=Path, help="output directory of long_definition.py")
+    parser.add_argument("--table-name", default="vaccinations")
+    parser.add_argument("--long", type=Path, help="write numbered doses in long format to this file")
+    parser.add_argument("--wide", type=Path, help="write doses in wide format to this file")
+    parser.add_argument(
+        "--disease", type=parse_disease, action="append", default=[],
+        metavar="TARGET_DISEASE=SHORT", help="target disease to include in the wide output",
+    )
+    parser.add_argument("--number-of-vaccines", type=int, default=10)
+    args = parser.parse_args()
+    if not (args.long or args.wide):
+        parser.error("at least one of --long or --wide is required")
+    if args.wide and not args.disease:
+        parser.error("--wide needs at least one --disease")
+
+    if args.long:
+        write_long(args.directory, args.long, args.table_name)
+    if args.wide:
+        write_wide(args.directory, args.wide, dict(args.disease), args.number_of_vaccines, args.table_name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+# Compressed bitmaps of the population on each index date, for cheap set operations on patients.
+#
+# analysis/population/dataset_definition.py extracts, once, whether each patient is registered and
+# alive on each of several index dates (eligible_{date} columns). This script turns that output into
+# one bitmap per date (bit patient_id is set if the patient is eligible), stored zlib-compressed:
+#   {column}.bin  compressed bitmap
+#   index.json    columns and number of eligible patients on each date
+# Intersections and unions across dates (eg patients eligible on every date of a cohort study) are
+# then bitwise operations, and other outputs can be filtered to a population without re-extracting it.
+#
+# Usage (from the root of the repo):
+#   python analysis/tools/population_bitmap.py build output/population/dataset.arrow output/population-bitmaps
+#   python analysis/tools/population_bitmap.py filter output/population-bitmaps output/PRIMIS/dataset.arrow \
+#       output/PRIMIS/dataset_cohort.csv.gz --all 2020-12-08 2021-12-08
+
+import argparse
+import csv
+import json
+import zlib
+from pathlib import Path
+
+from read_output import csv_value, open_output, read_file_rows
+
+
+def eligible_column(index_date):
+    return "eligible_" + str(index_date).replace("-", "_")
+
+def is_true(value):
+    return value is True or value == "T"
+
+
+class PopulationBitmap:
+    def __init__(self, bits=0):
+        self.bits = bits
+        self._bytes = None
+
+    @classmethod
+    def from_patient_ids(cls, patient_ids):
+        bits = bytearray()
+        for patient_id in patient_ids:
+            byte = patient_id >> 3
+            if byte >= len(bits):
+                bits.extend(bytes(byte + 1 - len(bits)))
+            bits[byte] |= 1 << (patient_id & 7)
+        return cls(int.from_bytes(bits, "little"))
+
+    @classmethod
+    def read(cls, path):
+        return cls(int.from_bytes(zlib.decompress(Path(path).read_bytes()), "little"))
+
+    def write(self, path):
+        Path(path).write_bytes(zlib.compress(self.to_bytes(), 9))
+
+    def to_bytes(self):
+        if self._bytes is None:
+            self._bytes = self.bits.to_bytes((self.bits.bit_length() + 7) // 8, "little")
+        return self._bytes
+
+    def __and__(self, other):
+        return PopulationBitmap(self.bits & other.bits)
+
+    def __or__(self, other):
+        return PopulationBitmap(self.bits | other.bits)
+
+    def __sub__(self, other):
+        return PopulationBitmap(self.bits & ~other.bits)
+
+    def __len__(self):
+        return self.bits.bit_count()
+
+    def __contains__(self, patient_id):
+        bits = self.to_bytes()
+        byte = patient_id >> 3
+        return byte < len(bits) and bool(bits[byte] & (1 << (patient_id & 7)))
+
+    def patient_ids(self):
+        for byte_number, byte in enumerate(self.to_bytes()):
+            if byte:
+                for bit in range(8):
+                    if byte & (1 << bit):
+                        yield (byte_number << 3) | bit
+
+
+# bitmaps of each eligible_{date} column of a population output
+def build_bitmaps(path, output_dir):
+    patient_ids = {}
+    for row in read_file_rows(path):
+        for column, value in row.items():
+            if column.startswith("eligible_") and is_true(value):
+                patient_ids.setdefault(column, []).append(int(row["patient_id"]))
+    output_dir.mkdir(parents=True, exist_ok=True)
+    counts = {}
+    for column, ids in patient_ids.items():
+        bitmap = PopulationBitmap.from_patient_ids(ids)
+        bitmap.write(output_dir / f"{column}.bin")
+        counts[column] = len(bitmap)
+    (output_dir / "index.json").write_text(json.dumps({"columns": counts}, indent=2))
+    return counts
+
+class PopulationBitmaps:
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.columns = json.loads((self.directory / "index.json").read_text())["columns"]
+
+    def on(self, index_date):
+        column = eligible_column(index_date)
+        if column not in self.columns:
+            return PopulationBitmap()
+        return PopulationBitmap.read(self.directory / f"{column}.bin")
+
+    def on_all(self, index_dates):
+        bitmap = self.on(index_dates[0])
+        for index_date in index_dates[1:]:
+            bitmap = bitmap & self.on(index_date)
+        return bitmap
+
+    def on_any(self, index_dates):
+        bitmap = PopulationBitmap()
+        for index_date in index_dates:
+            bitmap = bitmap | self.on(index_date)
+        return bitmap
+
+# copy the rows of an output (Arrow or CSV) for patients in the bitmap, as CSV
+def filter_output(bitmap, path, output):
+    with open_output(output) as f:
+        writer = None
+        for row in read_file_rows(path):
+            if writer is None:
+                writer = csv.writer(f)
+                writer.writerow(list(row))
+            if int(row["patient_id"]) in bitmap:
+                writer.writerow([csv_value(value) for value in row.values()])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="build bitmaps from a population output")
+    build_parser.add_argument("population", type=Path)
+    build_parser.add_argument("output_dir", type=Path)
+    for name, help in [("count", "print the number of patients"), ("filter", "filter an output to the patients")]:
+        subparser = subparsers.add_parser(name, help=f"{help} eligible on all (or any) of some dates")
+        subparser.add_argument("bitmaps", type=Path)
+        if name == "filter":
+            subparser.add_argument("input", type=Path)
+            subparser.add_argument("output", type=Path)
+        dates = subparser.add_mutually_exclusive_group(required=True)
+        dates.add_argument("--all", nargs="+", metavar="DATE")
+        dates.add_argument("--any", nargs="+", metavar="DATE")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        for column, count in build_bitmaps(args.population, args.output_dir).items():
+            print(f"{column}: {count} patients")
+        return
+    bitmaps = PopulationBitmaps(args.bitmaps)
+    bitmap = bitmaps.on_all(args.all) if args.all else bitmaps.on_any(args.any)
+    if args.command == "count":
+        print(len(bitmap))
+    elif args.command == "filter":
+        filter_output(bitmap, args.input, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# Decode and filter the packed PRIMIS flags columns added by primis_variables(..., packed=True).
+#
+# Each primis_flags{suffix} column holds the PRIMIS variables for one index date as bits of an
+# integer: bit i is set if primis_flag_names[i] (in analysis/PRIMIS/variables_function.py) is true.
+# Conditions are tested on the packed values directly, eg `value & mask(["ckd", "diabetes"])`,
+# so filtering or counting does not need the table to be unpacked.
+#
+# Usage (from the root of the repo):
+#   python analysis/tools/primis_flags.py decode output/PRIMIS/dataset.arrow output/PRIMIS/flags.csv.gz
+#   python analysis/tools/primis_flags.py filter output/PRIMIS/dataset.arrow output/PRIMIS/ckd_diabetes.csv.gz \
+#       --column primis_flags_0 --all ckd diabetes
+#   python analysis/tools/primis_flags.py count output/PRIMIS/dataset.arrow
+# --column can be left out if the output has a single packed column (eg primis_flags, for one index date).
+
+import argparse
+import csv
+import sys
+from pathlib import Path
+
+from codelist_index import read_assignment
+from read_output import csv_value, open_output, read_file_rows
+
+
+VARIABLES_FUNCTION = Path("analysis/PRIMIS/variables_function.py")
+
+PACKED_PREFIX = "primis_flags"
+
+
+# primis_flag_names from variables_function.py (read without importing it, as it needs ehrQL)
+def read_flag_names(path=VARIABLES_FUNCTION):
+    return read_assignment(path, "primis_flag_names")
+
+# bits of the named flags
+def mask(flag_names, names):
+    unknown = set(names) - set(flag_names)
+    if unknown:
+        raise ValueError(f"Unknown PRIMIS flags: {', '.join(sorted(unknown))}")
+    return sum(1 << flag_names.index(name) for name in names)
+
+# {flag name: bool} for a packed value (all None if the value is missing)
+def decode(flag_names, value):
+    if value is None or value == "":
+        return dict.fromkeys(flag_names)
+    value = int(value)
+    return {name: bool(value & (1 << bit)) for bit, name in enumerate(flag_names)}
+
+def packed_columns(columns):
+    return [column for column in columns if column.startswith(PACKED_PREFIX)]
+
+# the packed column to use: {column} if given, otherwise the only packed column in {columns}
+def packed_column(columns, column=None):
+    available = packed_columns(columns)
+    if column is None and len(available) == 1:
+        return available[0]
+    if column is not None and column in available:
+        return column
+    if column is None:
+        problem = "No packed columns" if not available else "Several packed columns, so choose one with --column"
+    else:
+        problem = f"No packed column {column}"
+    raise ValueError(f"{problem} (packed columns: {', '.join(available) or 'none'})")
+
+
+#####################################################
+# Commands
+#####################################################
+
+# write the table with each packed column expanded into one boolean column per flag
+# (named as the unpacked columns of primis_variables, eg primis_flags_0 -> ckd_0, diabetes_0, ...)
+def write_decoded(flag_names, path, output):
+    rows = read_file_rows(path)
+    with open_output(output) as f:
+        writer = None
+        for row in rows:
+            if writer is None:
+                writer = csv.writer(f)
+                header = []
+                for column in row:
+                    if column.startswith(PACKED_PREFIX):
+                        suffix = column[len(PACKED_PREFIX):]
+                        header += [f"{name}{suffix}" for name in flag_names]
+                    else:
+                        header.append(column)
+                writer.writerow(header)
+            values = []
+            for column, value in row.items():
+                if column.startswith(PACKED_PREFIX):
+                    values += [csv_value(flag) for flag in decode(flag_names, value).values()]
+                else:
+                    values.append(csv_value(value))
+            writer.writerow(values)
+
+# write the rows where all (or any) of the named flags are set in a packed column
+# (column can be None if there is only one, see packed_column)
+def write_filtered(flag_names, path, output, column, all_of=(), any_of=()):
+    all_mask = mask(flag_names, all_of)
+    any_mask = mask(flag_names, any_of)
+    with open_output(output) as f:
+        writer = None
+        for row in read_file_rows(path):
+            if writer is None:
+                column = packed_column(row, column)
+                writer = csv.writer(f)
+                writer.writerow(list(row))
+            value = row[column]
+            if value is None or value == "":
+                continue
+            value = int(value)
+            if (value & all_mask) == all_mask and (not any_mask or value & any_mask):
+                writer.writerow([csv_value(value) for value in row.values()])
+
+# {packed column: {flag name: number of patients with the flag set}}
+def count_flags(flag_names, path):
+    counts = {}
+    for row in read_file_rows(path):
+        for column in packed_columns(row):
+            value = row[column]
+            column_counts = counts.setdefault(column, dict.fromkeys(flag_names, 0))
+            if value is None or value == "":
+                continue
+            value = int(value)
+            for bit, name in enumerate(flag_names):
+                if value & (1 << bit):
+                    column_counts[name] += 1
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    decode_parser = subparsers.add_parser("decode", help="expand packed columns into boolean columns")
+    decode_parser.add_argument("path", type=Path)
+    decode_parser.add_argument("output", type=Path)
+    filter_parser = subparsers.add_parser("filter", help="keep rows with the given flags set")
+    filter_parser.add_argument("path", type=Path)
+    filter_parser.add_argument("output", type=Path)
+    filter_parser.add_argument("--column", help="packed column to filter on (if there are several)")
+    filter_parser.add_argument("--all", nargs="+", default=[], metavar="FLAG", help="flags that must all be set")
+    filter_parser.add_argument("--any", nargs="+", default=[], metavar="FLAG", help="flags of which one must be set")
+    count_parser = subparsers.add_parser("count", help="count patients with each flag set, for each packed column")
+    count_parser.add_argument("path", type=Path)
+    args = parser.parse_args()
+
+    if not VARIABLES_FUNCTION.exists():
+        sys.exit(f"Run this from the root of the repo (no {VARIABLES_FUNCTION})")
+    flag_names = read_flag_names()
+
+    if args.command == "decode":
+        write_decoded(flag_names, args.path, args.output)
+    elif args.command == "filter":
+        if not (args.all or args.any):
+            parser.error("filter needs --all or --any")
+        try:
+            write_filtered(flag_names, args.path, args.output, args.column, args.all, args.any)
+        except ValueError as error:
+            sys.exit(str(error))
+    elif args.command == "count":
+        for column, column_counts in count_flags(flag_names, args.path).items():
+            print(f"{column}: " + ", ".join(f"{name}={count}" for name, count in column_counts.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,536 @@
+# Intervals during which each PRIMIS condition holds, from one pass over each patient's events.
+#
+# Evaluating the PRIMIS variables (analysis/PRIMIS/variables_function.py) at many index dates repeats
+# the same "last code vs last resolution code" and rolling window comparisons for every date.
+# Instead, this script reads the events written by analysis/PRIMIS/events_definition.py and, for
+# each patient, finds every date on which a condition could change: the date of each event, the
+# dates on which an event enters or leaves a rolling window, and the patient's 18th birthday.
+# Each condition is constant between consecutive change dates, so it is evaluated once per change
+# date, and the results are written as intervals:
+#   patient_id, condition, start_date, end_date
+# where the condition holds from start_date to end_date inclusive (end_date is empty if it still
+# holds at the end of the events). Any index date can then be answered by looking up the intervals
+# (see `lookup`), at a cost that does not depend on how many index dates are asked for.
+#
+# The conditions are those added by primis_variables, and follow the definitions in
+# variables_function.py, including its treatment of missing values (a comparison with a missing date
+# is false). The variable names (primis_flag_names), codelists (primis_event_codelists,
+# primis_meds_codelists and codelists.codelist_files) and the windows and thresholds (the defaults of
+# PrimisParameters, which --parameter overrides as for a sensitivity analysis) are read from the PRIMIS
+# code rather than repeated here; only the rules themselves are restated, for a single patient.
+# Registration and death on each index date are not applied: filter to the population as usual.
+#
+# `check` tests the intervals against primis_variables: it runs events_definition.py and
+# timeline_check_definition.py (which adds primis_variables for a sample of dates) against local tables
+# with ehrQL (see run_local.py; the tables are generated with dummy_tables.py if they do not exist),
+# and compares every variable on every sampled date. It exits with an error if any differ.
+#
+# Usage (from the root of the repo):
+#   python analysis/tools/primis_timeline.py intervals output/PRIMIS-events output/PRIMIS-events/intervals.csv.gz
+#   python analysis/tools/primis_timeline.py intervals output/PRIMIS-events output/PRIMIS-events/intervals_bmi35.csv.gz \
+#       --parameter bmi_threshold=35.0
+#   python analysis/tools/primis_timeline.py lookup output/PRIMIS-events/intervals.csv.gz output/PRIMIS-events/flags.csv.gz \
+#       --dates 2021-03-31 2021-06-30 2021-09-30
+#   python analysis/tools/primis_timeline.py check --tables-dir dummy_tables/primis-timeline
+
+import argparse
+import ast
+import bisect
+import collections
+import csv
+import datetime
+import functools
+import subprocess
+import sys
+import types
+from pathlib import Path
+
+import dummy_tables
+from codelist_index import read_assignment, read_codes
+from read_output import open_output, read_file_rows, read_rows
+from run_local import generate_dataset_command
+
+
+VARIABLES_FUNCTION = Path("analysis/PRIMIS/variables_function.py")
+PRIMIS_CODELISTS = Path("analysis/PRIMIS/codelists.py")
+EVENTS_DEFINITION = Path("analysis/PRIMIS/events_definition.py")
+CHECK_DEFINITION = Path("analysis/PRIMIS/timeline_check_definition.py")
+
+
+#####################################################
+# PRIMIS definitions
+#####################################################
+
+# the defaults of PrimisParameters in variables_function.py, as {name: value}
+def read_primis_parameters(path=VARIABLES_FUNCTION):
+    for node in ast.parse(Path(path).read_text()).body:
+        if isinstance(node, ast.ClassDef) and node.name == "PrimisParameters":
+            return {
+                item.target.id: ast.literal_eval(item.value)
+                for item in node.body if isinstance(item, ast.AnnAssign) and item.value is not None
+            }
+    raise ValueError(f"No PrimisParameters in {path}")
+
+# PRIMIS parameters, as the defaults of PrimisParameters with any of {overrides} ([(name, value), ...])
+def primis_parameters(overrides=()):
+    parameters = read_primis_parameters()
+    for name, value in overrides:
+        if name not in parameters:
+            raise ValueError(f"Unknown PRIMIS parameter: {name}")
+        parameters[name] = value
+    return types.SimpleNamespace(**parameters)
+
+# the variables added by primis_variables, in order
+@functools.cache
+def condition_names():
+    return read_assignment(VARIABLES_FUNCTION, "primis_flag_names")
+
+# names of the clinical_events and medications codelists used by the PRIMIS conditions
+@functools.cache
+def primis_codelist_names():
+    return (
+        read_assignment(VARIABLES_FUNCTION, "primis_event_codelists"),
+        read_assignment(VARIABLES_FUNCTION, "primis_meds_codelists"),
+    )
+
+# durations, as ("days" or "years", n)
+def days(n):
+    return ("days", n)
+
+def years(n):
+    return ("years", n)
+
+# windows before the index date used by the conditions, as (start, end) as for CodelistSummary.window
+def primis_windows(parameters):
+    pregnancy_earlier = (
+        days(7 * parameters.pregnancy_earliest_weeks), days((7 * parameters.pregnancy_recent_weeks) + 1)
+    )
+    pregnancy_recent = (days(7 * parameters.pregnancy_recent_weeks), days(0))
+    immunosuppression = (years(parameters.immunosuppression_years), days(0))
+    return {
+        "astadm": [(years(2), days(0))],
+        "astrxm1": [(years(parameters.asthma_inhaler_years), days(0))],
+        "astrxm2": [(years(parameters.asthma_steroid_years), days(0))],
+        "immrx": [immunosuppression],
+        "immadm": [immunosuppression],
+        "dxt_chemo": [immunosuppression],
+        "preg": [pregnancy_earlier, pregnancy_recent],
+        "pregdel": [pregnancy_earlier],
+    }
+
+
+#####################################################
+# Dates
+#####################################################
+
+def as_date(value):
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(value)
+
+# as ehrQL: adding years to 29 February gives 1 March in a year that is not a leap year
+def add_years(date, n):
+    try:
+        return date.replace(year=date.year + n)
+    except ValueError:
+        return date.replace(year=date.year + n, month=3, day=1)
+
+def subtract(date, duration):
+    unit, n = duration
+    if unit == "days":
+        return date - datetime.timedelta(days=n)
+    return add_years(date, -n)
+
+# dates on which an event on `date` enters or leaves a window: it is in the window on index date d
+# when subtract(d, start) <= date <= subtract(d, end); for years, the dates either side of the
+# boundary are included too, as the boundary moves around 29 February
+def window_change_dates(date, start, end):
+    dates = []
+    for duration, offset in ((end, 0), (start, 1)):
+        unit, n = duration
+        if unit == "days":
+            dates.append(date + datetime.timedelta(days=n + offset))
+        else:
+            boundary = add_years(date, n)
+            dates.extend(boundary + datetime.timedelta(days=i) for i in (-1, 0, 1, 2))
+    return dates
+
+
+#####################################################
+# Conditions
+#####################################################
+
+# one patient's events in each codelist, sorted by date, for evaluating the conditions with {parameters}
+class PatientEvents:
+    def __init__(self, date_of_birth, events, parameters):
+        self.date_of_birth = date_of_birth
+        self.parameters = parameters
+        self.windows = primis_windows(parameters)
+        # {codelist name: [date, ...]}
+        self.dates = {name: sorted(dates) for name, dates in events.items() if name != "bmi"}
+        # BMI events with a value in range, as ([date, ...], [value, ...]) sorted by date
+        bmi = sorted(
+            (date, value) for date, value in events.get("bmi", [])
+            if value is not None and parameters.bmi_min < value < parameters.bmi_max
+        )
+        self.bmi_dates = [date for date, _ in bmi]
+        self.bmi_values = [value for _, value in bmi]
+
+    def change_dates(self):
+        dates = set()
+        for name, event_dates in self.dates.items():
+            dates.update(event_dates)
+            for start, end in self.windows.get(name, []):
+                for date in event_dates:
+                    dates.update(window_change_dates(date, start, end))
+        dates.update(self.bmi_dates)
+        if self.date_of_birth is not None:
+            birthday = add_years(self.date_of_birth, 18)
+            dates.update(birthday + datetime.timedelta(days=i) for i in (-1, 0, 1))
+        return sorted(dates)
+
+    def last_date(self, name, index_date, start=None, end=days(0)):
+        dates = self.dates.get(name, [])
+        i = bisect.bisect_right(dates, subtract(index_date, end))
+        if i == 0:
+            return None
+        if start is not None and dates[i - 1] < subtract(index_date, start):
+            return None
+        return dates[i - 1]
+
+    def exists(self, name, index_date, start=None, end=days(0)):
+        return self.last_date(name, index_date, start, end) is not None
+
+    def count(self, name, index_date, start, end=days(0)):
+        dates = self.dates.get(name, [])
+        return (
+            bisect.bisect_right(dates, subtract(index_date, end))
+            - bisect.bisect_left(dates, subtract(index_date, start))
+        )
+
+    def last_bmi(self, index_date):
+        i = bisect.bisect_right(self.bmi_dates, index_date)
+        if i == 0:
+            return None, None
+        return self.bmi_dates[i - 1], self.bmi_values[i - 1]
+
+    def age(self, index_date):
+        if self.date_of_birth is None:
+            return None
+        age = index_date.year - self.date_of_birth.year
+        if (index_date.month, index_date.day) < (self.date_of_birth.month, self.date_of_birth.day):
+            age -= 1
+        return age
+
+
+# a < b, where a comparison with a missing date is false (as in a case/when condition)
+def before(a, b):
+    return a is not None and b is not None and a < b
+
+def has_asthma(events, d):
+    parameters = events.parameters
+    if events.exists("astadm", d, years(2)):
+        return True
+    return (
+        events.exists("ast", d)
+        and events.exists("astrxm1", d, years(parameters.asthma_inhaler_years))
+        and events.count("astrxm2", d, years(parameters.asthma_steroid_years)) >= 2
+    )
+
+def has_ckd(events, d):
+    if events.exists("ckd_cov", d):
+        return True
+    ckd15_date = events.last_date("ckd15", d)
+    ckd35_date = events.last_date("ckd35", d)
+    return ckd15_date is not None and ckd35_date is not None and ckd35_date >= ckd15_date
+
+def has_crd(events, d):
+    return events.exists("resp_cov", d) or has_asthma(events, d)
+
+def has_severe_obesity(events, d):
+    age = events.age(d)
+    if age is not None and age < 18:
+        return False
+    date_bmi_stage = events.last_date("bmi_stage", d)
+    date_sev_obesity = events.last_date("sev_obesity", d)
+    bmi_date, bmi_value = events.last_bmi(d)
+    if before(bmi_date, date_sev_obesity) or (date_sev_obesity is not None and bmi_date is None):
+        return True
+    if bmi_value is not None and bmi_value >= events.parameters.bmi_threshold:
+        if date_bmi_stage is None or bmi_date >= date_bmi_stage:
+            return True
+    return False
+
+def has_pregnancy(events, d):
+    (earlier_start, earlier_end), (recent_start, _) = events.windows["preg"]
+    if events.exists("preg", d, recent_start):
+        return True
+    pregAdel_date = events.last_date("pregdel", d, earlier_start, earlier_end)
+    pregA_date = events.last_date("preg", d, earlier_start, earlier_end)
+    return before(pregAdel_date, pregA_date)
+
+def has_diabetes(events, d):
+    date_diab = events.last_date("diab", d)
+    date_dmres = events.last_date("dmres", d)
+    return (
+        before(date_dmres, date_diab)
+        or (date_diab is not None and date_dmres is None)
+        or events.exists("addis", d)
+        or (events.exists("gdiab", d) and has_pregnancy(events, d))
+    )
+
+def is_immunosuppressed(events, d):
+    window = years(events.parameters.immunosuppression_years)
+    return (
+        events.exists("immdx_cov", d)
+        or events.exists("immrx", d, window)
+        or events.exists("immadm", d, window)
+        or events.exists("dxt_chemo", d, window)
+    )
+
+def has_smi(events, d):
+    date_sev_mental = events.last_date("sev_mental", d)
+    date_smhres = events.last_date("smhres", d)
+    return before(date_smhres, date_sev_mental) or (date_sev_mental is not None and date_smhres is None)
+
+# the conditions added by primis_variables, as {name: bool}
+def primis_conditions(events, d):
+    conditions = {
+        "immunosuppressed": is_immunosuppressed(events, d),
+        "ckd": has_ckd(events, d),
+        "crd": events.exists("resp_cov", d),
+        "diabetes": has_diabetes(events, d),
+        "cld": events.exists("cld", d),
+        "chd": events.exists("chd_cov", d),
+        "cns": events.exists("cns_cov", d),
+        "asplenia": events.exists("spln_cov", d),
+        "learndis": events.exists("learndis", d),
+        "smi": has_smi(events, d),
+        "severe_obesity": has_severe_obesity(events, d),
+    }
+    # at risk uses has_crd (including asthma), rather than the crd variable
+    conditions["primis_atrisk"] = has_crd(events, d) or any(
+        value for name, value in conditions.items() if name != "crd"
+    )
+    if set(conditions) != set(condition_names()):
+        raise ValueError("The conditions here do not match primis_flag_names in variables_function.py")
+    return conditions
+
+# {condition: [(start_date, end_date or None), ...]} for one patient
+def condition_intervals(events):
+    intervals = {name: [] for name in condition_names()}
+    open_since = {}
+    for d in events.change_dates():
+        for name, value in primis_conditions(events, d).items():
+            if value and name not in open_since:
+                open_since[name] = d
+            elif not value and name in open_since:
+                intervals[name].append((open_since.pop(name), d - datetime.timedelta(days=1)))
+    for name, start in open_since.items():
+        intervals[name].append((start, None))
+    return intervals
+
+
+#####################################################
+# Reading events
+#####################################################
+
+# {code: [codelist name, ...]} for each of the given codelists, with the CSV paths in codelists.codelist_files
+def codelists_by_code(names):
+    files = read_assignment(PRIMIS_CODELISTS, "codelist_files")
+    by_code = collections.defaultdict(list)
+    for name in names:
+        for code in read_codes(files[name]):
+            by_code[code].append(name)
+    return by_code
+
+# rows of a table grouped by patient, advancing to the given patient_id (rows must be in patient order,
+# and patients must be taken in that order, otherwise their rows would be silently skipped)
+class PatientRows:
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.next_row = None
+        self.last_row_id = None
+        self.last_patient_id = None
+        self.advance()
+
+    def advance(self):
+        self.next_row = next(self.rows, None)
+        if self.next_row is not None:
+            row_id = int(self.next_row["patient_id"])
+            if self.last_row_id is not None and row_id < self.last_row_id:
+                raise ValueError(f"Rows are not in patient order: patient {row_id} after {self.last_row_id}")
+            self.last_row_id = row_id
+
+    def take(self, patient_id):
+        if self.last_patient_id is not None and patient_id < self.last_patient_id:
+            raise ValueError(f"Patients are not in order: patient {patient_id} after {self.last_patient_id}")
+        self.last_patient_id = patient_id
+        taken = []
+        while self.next_row is not None and int(self.next_row["patient_id"]) <= patient_id:
+            if int(self.next_row["patient_id"]) == patient_id:
+                taken.append(self.next_row)
+            self.advance()
+        return taken
+
+# (patient_id, PatientEvents) for each patient in the output of events_definition.py
+def read_patients(directory, parameters):
+    event_codelists, meds_codelists = primis_codelist_names()
+    events_by_code = codelists_by_code(event_codelists)
+    meds_by_code = codelists_by_code(meds_codelists)
+    clinical_events = PatientRows(read_rows(directory, "clinical_events"))
+    medications = PatientRows(read_rows(directory, "medications"))
+    for patient in read_rows(directory, "dataset"):
+        patient_id = int(patient["patient_id"])
+        events = collections.defaultdict(list)
+        for row in clinical_events.take(patient_id):
+            date = as_date(row["date"])
+            for name in events_by_code.get(int(row["snomedct_code"]), []):
+                if name == "bmi":
+                    value = row["numeric_value"]
+                    events[name].append((date, float(value) if value not in (None, "") else None))
+                else:
+                    events[name].append(date)
+        for row in medications.take(patient_id):
+            for name in meds_by_code.get(int(row["dmd_code"]), []):
+                events[name].append(as_date(row["date"]))
+        yield patient_id, PatientEvents(as_date(patient["date_of_birth"]), events, parameters)
+
+
+#####################################################
+# Intervals
+#####################################################
+
+def write_intervals(directory, output, parameters):
+    with open_output(output) as f:
+        writer = csv.writer(f)
+        writer.writerow(["patient_id", "condition", "start_date", "end_date"])
+        for patient_id, events in read_patients(directory, parameters):
+            for name, intervals in condition_intervals(events).items():
+                for start, end in intervals:
+                    writer.writerow([patient_id, name, start, end or ""])
+
+# intervals written by write_intervals, for looking up conditions on any date
+class ConditionIntervals:
+    def __init__(self, path):
+        # {condition: {patient_id: ([start, ...], [end, ...])}}
+        self.intervals = {name: {} for name in condition_names()}
+        self.patient_ids = set()
+        for row in read_file_rows(path):
+            patient_id = int(row["patient_id"])
+            self.patient_ids.add(patient_id)
+            starts, ends = self.intervals[row["condition"]].setdefault(patient_id, ([], []))
+            starts.append(as_date(row["start_date"]))
+            ends.append(as_date(row["end_date"]))
+
+    def holds(self, condition, patient_id, date):
+        starts, ends = self.intervals[condition].get(patient_id, ((), ()))
+        i = bisect.bisect_right(starts, date) - 1
+        return i >= 0 and (ends[i] is None or date <= ends[i])
+
+# conditions on each date, as primis_variables would add them for a list of index dates
+# (only patients with at least one interval are written: every condition is false for the others)
+def write_lookup(intervals_path, output, dates):
+    intervals = ConditionIntervals(intervals_path)
+    with open_output(output) as f:
+        writer = csv.writer(f)
+        writer.writerow(["patient_id"] + [f"{name}_{i}" for i in range(len(dates)) for name in condition_names()])
+        for patient_id in sorted(intervals.patient_ids):
+            writer.writerow([patient_id] + [
+                "T" if intervals.holds(name, patient_id, date) else "F"
+                for date in dates for name in condition_names()
+            ])
+
+
+#####################################################
+# Checking against primis_variables
+#####################################################
+
+# the index dates sampled by timeline_check_definition.py
+def check_dates():
+    return [as_date(date) for date in read_assignment(CHECK_DEFINITION, "index_dates")]
+
+# synthetic tables, with a high prevalence so that every condition (and its changes) occurs often
+def ensure_tables(tables_dir, population_size):
+    if not (tables_dir / "clinical_events.csv.gz").exists():
+        generator = dummy_tables.DummyTableGenerator(
+            codelists=dummy_tables.load_codelists(Path("codelists")),
+            prevalence={"default": 0.2},
+            seed="primis-timeline",
+            start_date=datetime.date(2015, 1, 1),
+            end_date=datetime.date(2025, 12, 31),
+            background_events=5.0,
+        )
+        dummy_tables.write_tables(generator, population_size, 100_000, tables_dir)
+
+# runs events_definition.py and timeline_check_definition.py against {tables_dir}, and compares the
+# intervals with the primis_variables output on each sampled date
+# returns the number of values compared, and [(patient_id, variable, date, primis_variables value), ...]
+# for the values that differ
+def check_intervals(tables_dir, output_dir):
+    output_dir.mkdir(parents=True, exist_ok=True)
+    events_dir = output_dir / "events"
+    subprocess.run(generate_dataset_command(EVENTS_DEFINITION, tables_dir, f"{events_dir}:arrow"), check=True)
+    subprocess.run(generate_dataset_command(CHECK_DEFINITION, tables_dir, output_dir / "variables.arrow"), check=True)
+    intervals_path = output_dir / "intervals.csv.gz"
+    write_intervals(events_dir, intervals_path, primis_parameters())
+    intervals = ConditionIntervals(intervals_path)
+    dates = check_dates()
+    comparisons = 0
+    mismatches = []
+    for row in read_rows(output_dir, "variables"):
+        patient_id = int(row["patient_id"])
+        for i, date in enumerate(dates):
+            for name in condition_names():
+                expected = row[f"{name}_{i}"] in (True, "T")
+                comparisons += 1
+                if intervals.holds(name, patient_id, date) != expected:
+                    mismatches.append((patient_id, name, date, expected))
+    return comparisons, mismatches
+
+
+def parse_parameter(value):
+    name, _, parameter = value.partition("=")
+    return name, ast.literal_eval(parameter)
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    intervals_parser = subparsers.add_parser("intervals", help="write the intervals during which each condition holds")
+    intervals_parser.add_argument("directory", type=Path, help="output directory of events_definition.py")
+    intervals_parser.add_argument("output", type=Path)
+    intervals_parser.add_argument(
+        "--parameter", type=parse_parameter, action="append", default=[],
+        metavar="NAME=VALUE", help="override a PrimisParameters default, eg bmi_threshold=35.0",
+    )
+    lookup_parser = subparsers.add_parser("lookup", help="write the conditions on each of several dates")
+    lookup_parser.add_argument("intervals", type=Path)
+    lookup_parser.add_argument("output", type=Path)
+    lookup_parser.add_argument("--dates", type=datetime.date.fromisoformat, nargs="+", required=True)
+    check_parser = subparsers.add_parser("check", help="compare the intervals with primis_variables on local tables")
+    check_parser.add_argument("--tables-dir", type=Path, default=Path("dummy_tables/primis-timeline"))
+    check_parser.add_argument("--population-size", type=int, default=2000, help="if the tables are generated")
+    check_parser.add_argument("--output-dir", type=Path, default=Path("output/primis-timeline-check"))
+    args = parser.parse_args()
+
+    if not (VARIABLES_FUNCTION.exists() and PRIMIS_CODELISTS.exists()):
+        sys.exit(f"Run this from the root of the repo (no {VARIABLES_FUNCTION})")
+
+    if args.command == "intervals":
+        write_intervals(args.directory, args.output, primis_parameters(args.parameter))
+    elif args.command == "lookup":
+        write_lookup(args.intervals, args.output, args.dates)
+    elif args.command == "check":
+        ensure_tables(args.tables_dir, args.population_size)
+        comparisons, mismatches = check_intervals(args.tables_dir, args.output_dir)
+        for patient_id, name, date, expected in mismatches[:20]:
+            print(f"patient {patient_id}: {name} on {date} is {expected} in primis_variables, {not expected} in the intervals")
+        print(f"{len(mismatches)} of {comparisons} values differ")
+        if mismatches:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+# Profile the reusable variable functions used by a dataset definition.
+#
+# benchmark.py reports one run time and plan size per definition. This script instead wraps every
+# public function in the variable modules of this repo (listed in MODULES) before running a definition,
+# so that each call records:
+#   build_time   seconds spent building the query, including calls to other wrapped functions
+#   self_time    build_time less the time spent in (and profiling) wrapped functions it called
+#   plan_nodes   number of distinct query model nodes in the result (or, for functions that add
+#                columns to a dataset, in the columns added)
+#   codelists    the codelists used by the result, and the number of codes in each
+# Calls are grouped by call stack (eg primis_atrisk > primis_summary > codelist_events).
+#
+# Two reports are written to logs/ (as an action's logs would be):
+#   {name}-profile.json    the calls above, for each call stack
+#   {name}-profile.folded  self time in microseconds for each call stack, in the collapsed stack
+#                          format read by flamegraph.pl and speedscope
+#
+# Instrumentation is opt-in: the modules themselves are unchanged, and are only wrapped while this
+# script runs a definition. Query evaluation is not profiled: ehrQL evaluates all columns of a
+# dataset together, and does not report time or rows per column (see benchmark.py for run times).
+#
+# Usage (from the root of the repo):
+#   python analysis/tools/profile_variables.py analysis/PRIMIS/dataset_definition.py
+#   python analysis/tools/profile_variables.py analysis/vaccine-history/dataset_definition.py --logs-dir logs
+
+import argparse
+import collections
+import functools
+import inspect
+import json
+import runpy
+import sys
+import time
+from pathlib import Path
+
+from ehrql.codes import BaseCode
+from ehrql.query_model.nodes import Value
+
+from query_plan import (
+    _distinct_subtree, check_working_directory, count_plan_nodes, dataset_nodes, definition_directory,
+)
+
+
+# variable modules to instrument, by directory
+MODULES = {
+    "analysis/PRIMIS": ["variables_function"],
+    "analysis/vaccine-history": ["vaccine_variables"],
+    "analysis/ethnicity": ["ethnicity_variables"],
+}
+
+
+#####################################################
+# Recording calls
+#####################################################
+
+class Profiler:
+    def __init__(self):
+        self.stack = []
+        # {call stack: {"calls": ..., "build_time": ..., "self_time": ..., ...}}
+        self.calls = collections.defaultdict(
+            lambda: {"calls": 0, "build_time": 0.0, "self_time": 0.0, "plan_nodes": 0, "codelists": {}}
+        )
+        self.codelists_module = None
+        self.unnamed_code_sets = []
+        # {name: (codelist, frozenset of its codes)}, so code sets are only built once per codelist
+        self.codelist_codes = {}
+
+    def wrap(self, function, name):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            wrapper_start = time.perf_counter()
+            self.stack.append([name, 0.0])
+            dataset = dataset_argument(function, args, kwargs)
+            columns_before = set(dataset_nodes(dataset)) if dataset is not None else None
+            start = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                _, child_time = self.stack.pop()
+            call_stack = ";".join([frame[0] for frame in self.stack] + [name])
+            if dataset is not None:
+                added = dataset_nodes(dataset)
+                nodes = [node for column, node in added.items() if column not in columns_before]
+            else:
+                nodes = result_nodes(result)
+            record = self.calls[call_stack]
+            record["calls"] += 1
+            record["build_time"] += elapsed
+            record["self_time"] += elapsed - child_time
+            record["plan_nodes"] = max(record["plan_nodes"], count_plan_nodes(*nodes) if nodes else 0)
+            record["codelists"].update(self.codelists_used(nodes))
+            # the time spent profiling this call is not counted in the caller's self time
+            if self.stack:
+                self.stack[-1][1] += time.perf_counter() - wrapper_start
+            return result
+        return wrapper
+
+    # {codelist name: number of codes} for the code sets that the nodes filter on
+    def codelists_used(self, nodes):
+        names = self.codelist_names()
+        used = {}
+        for codes in code_sets(nodes):
+            if codes not in names:
+                if codes not in self.unnamed_code_sets:
+                    self.unnamed_code_sets.append(codes)
+                names[codes] = f"unnamed_{self.unnamed_code_sets.index(codes) + 1}"
+            used[names[codes]] = len(codes)
+        return used
+
+    # {codes: name} for the codelists defined in the definition's codelists module, either as module
+    # attributes or loaded lazily into `loaded_codelists` (codelists are loaded before they are used,
+    # so are always named by the time a query using them has been built)
+    def codelist_names(self):
+        if self.codelists_module is None:
+            return {}
+        named = dict(vars(self.codelists_module))
+        named.update(getattr(self.codelists_module, "loaded_codelists", {}))
+        names = {}
+        for name, value in named.items():
+            if name.startswith("_"):
+                continue
+            if self.codelist_codes.get(name, (None,))[0] is not value:
+                self.codelist_codes[name] = (value, codelist_code_set(value))
+            codes = self.codelist_codes[name][1]
+            if codes:
+                names[codes] = name
+        return names
+
+    # names of the codelists used by any call (not unnamed_N)
+    def named_codelists(self):
+        return {
+            name for record in self.calls.values() for name in record["codelists"]
+            if not name.startswith("unnamed_")
+        }
+
+    def report(self):
+        return {
+            call_stack: {**record, "build_time": round(record["build_time"], 6), "self_time": round(record["self_time"], 6)}
+            for call_stack, record in sorted(self.calls.items())
+        }
+
+    def folded(self):
+        return "".join(
+            f"{call_stack} {round(record['self_time'] * 1e6)}\n"
+            for call_stack, record in sorted(self.calls.items())
+        )
+
+
+def dataset_argument(function, args, kwargs):
+    try:
+        arguments = inspect.signature(function).bind_partial(*args, **kwargs).arguments
+    except (TypeError, ValueError):
+        return None
+    return arguments.get("dataset")
+
+# query model nodes of a series or frame, or of the series and frames in a dict, list or object
+# (eg a dict of CodelistSummary)
+def result_nodes(result, depth=2):
+    if hasattr(result, "_qm_node"):
+        return [result._qm_node]
+    if depth == 0:
+        return []
+    if isinstance(result, dict):
+        values = result.values()
+    elif isinstance(result, (list, tuple)):
+        values = result
+    elif hasattr(result, "__dict__") and not inspect.isroutine(result) and not inspect.ismodule(result):
+        values = vars(result).values()
+    else:
+        return []
+    return [node for value in values for node in result_nodes(value, depth - 1)]
+
+# a code as a string, whether it is a code object (as in query model nodes) or already a string
+def code_string(code):
+    return code.value if isinstance(code, BaseCode) else str(code)
+
+# the codes of a codelist as loaded by codelist_from_csv (a list of code strings, or a dict keyed by
+# code string if a category column was given), or None for anything else
+def codelist_code_set(value):
+    if isinstance(value, dict):
+        codes = value.keys()
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        codes = value
+    else:
+        return None
+    if not codes or not all(isinstance(code, (str, BaseCode)) for code in codes):
+        return None
+    return frozenset(code_string(code) for code in codes)
+
+# the code sets (as frozensets of code strings) that the nodes filter on
+def code_sets(nodes):
+    found = []
+    seen = set()
+    for root in nodes:
+        for node in _distinct_subtree(root):
+            if isinstance(node, Value) and isinstance(node.value, frozenset) and node.value:
+                if all(isinstance(code, BaseCode) for code in node.value):
+                    codes = frozenset(code_string(code) for code in node.value)
+                    if codes not in seen:
+                        seen.add(codes)
+                        found.append(codes)
+    return found
+
+
+#####################################################
+# Instrumenting modules
+#####################################################
+
+def public_functions(module):
+    return {
+        name: value for name, value in vars(module).items()
+        if not name.startswith("_") and inspect.isfunction(value)
+        and getattr(value, "__module__", None) == module.__name__
+    }
+
+# wrap the public functions of each module in MODULES found in the definition's directory; as the
+# modules stay imported while the definition runs, it (and the modules' calls to each other) use
+# the wrapped functions
+def instrument(profiler, directory):
+    instrumented = False
+    for module_directory, names in MODULES.items():
+        if Path(module_directory).resolve() != Path(directory).resolve():
+            continue
+        for name in names:
+            module = __import__(name)
+            for function_name, function in public_functions(module).items():
+                setattr(module, function_name, profiler.wrap(function, function_name))
+            instrumented = True
+    if Path(directory, "codelists.py").exists():
+        profiler.codelists_module = __import__("codelists")
+    return instrumented
+
+def profile_definition(path):
+    path = Path(path)
+    profiler = Profiler()
+    with definition_directory(path.parent):
+        if not instrument(profiler, path.parent):
+            sys.exit(f"No variable modules to profile in {path.parent}")
+        start = time.perf_counter()
+        runpy.run_path(str(path))
+        total_time = time.perf_counter() - start
+    return profiler, total_time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("definition", type=Path)
+    parser.add_argument("--logs-dir", type=Path, default=Path("logs"))
+    args = parser.parse_args()
+    check_working_directory()
+
+    profiler, total_time = profile_definition(args.definition)
+    # the report is only useful if the codelists behind each subtree can be named
+    if profiler.unnamed_code_sets and not profiler.named_codelists():
+        sys.exit(
+            f"None of the {len(profiler.unnamed_code_sets)} code sets used could be matched to a codelist "
+            f"in {args.definition.parent / 'codelists.py'}"
+        )
+    name = args.definition.parent.name
+    args.logs_dir.mkdir(parents=True, exist_ok=True)
+    report_path = args.logs_dir / f"{name}-profile.json"
+    report_path.write_text(json.dumps({"total_time": total_time, "calls": profiler.report()}, indent=2))
+    folded_path = args.logs_dir / f"{name}-profile.folded"
+    folded_path.write_text(profiler.folded())
+
+    print(f"{'call':<60} {'calls':>6} {'build_time':>11} {'self_time':>10} {'plan_nodes':>11}")
+    for call_stack, record in sorted(profiler.calls.items(), key=lambda item: -item[1]["build_time"]):
+        print(
+            f"{call_stack[-60:]:<60} {record['calls']:>6} {record['build_time']:>11.4f} "
+            f"{record['self_time']:>10.4f} {record['plan_nodes']:>11}"
+        )
+    print(f"\nReports written to {report_path} and {folded_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+# Helpers for inspecting the ehrQL query plans built by the dataset definitions and variables in this repo.
+#
+# These need ehrQL to be importable (eg in a codespace), as they build the queries in-process.
+#
+# Run as a script, this reports for each column of a dataset definition how many table scans,
+# filters, sorts and per-patient aggregations it expands to, and lists subtrees that are built more
+# than once (eg the same filter rebuilt on every call to a function). ehrQL only evaluates each
+# distinct subtree once, but rebuilding them makes query plans larger and slower to compile.
+#
+# Usage (from the root of the repo):
+#   python analysis/tools/query_plan.py analysis/PRIMIS/dataset_definition.py
+#   python analysis/tools/query_plan.py analysis/PRIMIS/dataset_definition.py --json
+
+import argparse
+import collections
+import dataclasses
+import json
+import os
+import runpy
+import sys
+from contextlib import contextmanager
+from pathlib import Path
+
+from ehrql.query_model.nodes import Node
+
+
+# Directories in analysis/ each have their own `codelists` module (and so on), so modules imported
+# while loading a definition are removed again afterwards, so that the next definition gets its own.
+@contextmanager
+def definition_directory(directory):
+    directory = str(Path(directory).resolve())
+    modules_before = set(sys.modules)
+    sys.path.insert(0, directory)
+    try:
+        yield
+    finally:
+        sys.path.remove(directory)
+        for name in set(sys.modules) - modules_before:
+            if getattr(sys.modules[name], "__file__", "") and sys.modules[name].__file__.startswith(directory):
+                del sys.modules[name]
+
+# run a dataset definition (from the root of the repo, as ehrQL does) and return its globals
+def load_definition(path):
+    path = Path(path)
+    with definition_directory(path.parent):
+        return runpy.run_path(str(path))
+
+# import a module of variable functions from a directory in analysis/, eg
+#   with load_module("analysis/PRIMIS", "variables_function") as variables_function: ...
+@contextmanager
+def load_module(directory, name):
+    with definition_directory(directory):
+        yield __import__(name)
+
+# columns of a dataset, as {column name: query model node}
+def dataset_nodes(dataset):
+    variables = getattr(dataset, "variables", None)
+    if variables is None:
+        variables = dataset._variables
+    return {name: series._qm_node for name, series in variables.items()}
+
+def child_nodes(node):
+    for field in dataclasses.fields(node):
+        yield from _nodes_in(getattr(node, field.name))
+
+def _nodes_in(value):
+    if isinstance(value, Node):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.items():
+            yield from _nodes_in(item)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for item in value:
+            yield from _nodes_in(item)
+
+# number of distinct nodes in the trees below the given nodes: ehrQL treats equal nodes as the
+# same node, so this is the size of the plan that is actually evaluated
+def count_plan_nodes(*nodes):
+    seen = set()
+    stack = list(nodes)
+    while stack:
+        node = stack.pop()
+        if node not in seen:
+            seen.add(node)
+            stack.extend(child_nodes(node))
+    return len(seen)
+
+# run from the root of the repo
+def check_working_directory():
+    if not Path("codelists").is_dir():
+        sys.exit(f"Run this from the root of the repo (not {os.getcwd()})")
+
+
+#####################################################
+# Plan report
+#####################################################
+
+# kinds of node counted for each column
+NODE_KINDS = {
+    "scans": ("SelectTable", "SelectPatientTable"),
+    "filters": ("Filter",),
+    "sorts": ("Sort",),
+    "aggregations": ("PickOneRowPerPatient", "AggregateByPatient."),
+}
+
+def node_kind(node):
+    name = type(node).__qualname__
+    for kind, prefixes in NODE_KINDS.items():
+        if name.startswith(prefixes):
+            return kind
+    return None
+
+# counts of each kind of node among the distinct nodes used by a column
+def column_counts(node):
+    counts = dict.fromkeys(NODE_KINDS, 0)
+    seen = set()
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node not in seen:
+            seen.add(node)
+            kind = node_kind(node)
+            if kind:
+                counts[kind] += 1
+            stack.extend(child_nodes(node))
+    counts["nodes"] = len(seen)
+    return counts
+
+# the tables read by a node, eg "clinical_events"
+def source_tables(node):
+    return sorted({
+        child.name for child in _distinct_subtree(node)
+        if node_kind(child) == "scans"
+    })
+
+def _distinct_subtree(node):
+    seen = set()
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if id(node) not in seen:
+            seen.add(id(node))
+            yield node
+            stack.extend(child_nodes(node))
+
+# subtrees (filters, sorts and aggregations) that are equal, but were built separately,
+# as a list of (node, number of times built, columns using it), largest first
+def duplicated_subtrees(nodes_by_column):
+    built = collections.defaultdict(set)
+    columns = collections.defaultdict(set)
+    for column, root in nodes_by_column.items():
+        for node in _distinct_subtree(root):
+            if node_kind(node) in ("filters", "sorts", "aggregations"):
+                built[node].add(id(node))
+                columns[node].add(column)
+    duplicates = [
+        (node, len(ids), sorted(columns[node]))
+        for node, ids in built.items()
+        if len(ids) > 1
+    ]
+    duplicates.sort(key=lambda item: (count_plan_nodes(item[0]), item[1]), reverse=True)
+    return duplicates
+
+def plan_report(dataset, top=20):
+    nodes_by_column = dataset_nodes(dataset)
+    return {
+        "columns": {column: column_counts(node) for column, node in nodes_by_column.items()},
+        "total_nodes": count_plan_nodes(*nodes_by_column.values()),
+        "duplicated_subtrees": [
+            {
+                "kind": type(node).__qualname__,
+                "tables": source_tables(node),
+                "nodes": count_plan_nodes(node),
+                "times_built": times_built,
+                "columns": columns,
+            }
+            for node, times_built, columns in duplicated_subtrees(nodes_by_column)[:top]
+        ],
+    }
+
+def print_report(report):
+    print(f"{'column':<30} {'nodes':>6} {'scans':>6} {'filters':>8} {'sorts':>6} {'aggregations':>13}")
+    for column, counts in report["columns"].items():
+        print(
+            f"{column:<30} {counts['nodes']:>6} {counts['scans']:>6} {counts['filters']:>8} "
+            f"{counts['sorts']:>6} {counts['aggregations']:>13}"
+        )
+    print(f"\n{report['total_nodes']} distinct nodes in total")
+    if report["duplicated_subtrees"]:
+        print("\nSubtrees built more than once:")
+    for duplicate in report["duplicated_subtrees"]:
+        columns = duplicate["columns"]
+        print(
+            f"  {duplicate['kind']} on {', '.join(duplicate['tables'])} "
+            f"({duplicate['nodes']} nodes) built {duplicate['times_built']} times, "
+            f"used by {', '.join(columns[:5])}{' ...' if len(columns) > 5 else ''}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("definition", type=Path)
+    parser.add_argument("--top", type=int, default=20, help="number of duplicated subtrees to list")
+    parser.add_argument("--json", action="store_true", help="output the report as JSON")
+    args = parser.parse_args()
+    check_working_directory()
+    report = plan_report(load_definition(args.definition)["dataset"], top=args.top)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# Read the outputs of the dataset definitions in this repo.
+#
+# The actions in project.yaml write Arrow files (`--output dataset.arrow`) rather than gzipped CSV:
+# columns keep their types (booleans, dates, integers), ehrQL dictionary-encodes categorical columns,
+# and files can be memory-mapped, so reading a few columns does not read or parse the rest of the file.
+#
+# This script also converts an output to Parquet, dictionary-encoding repetitive string columns
+# (eg the vaccine product names) and storing per-column statistics, for archiving or sharing.
+#
+# Needs pyarrow (available in the python:v2 image, or `pip install pyarrow`), except for reading and
+# writing CSV outputs with read_rows / open_output, which the other tools here use for outputs of
+# either format.
+#
+# Usage (from the root of the repo):
+#   python analysis/tools/read_output.py stats output/vaccine-history/dataset.arrow
+#   python analysis/tools/read_output.py to-parquet output/vaccine-history/dataset.arrow output/vaccine-history/dataset.parquet
+#
+# or from python:
+#   read_columns("output/PRIMIS/dataset.arrow", ["patient_id", "primis_atrisk"]).to_pandas()
+
+import argparse
+import csv
+import gzip
+from pathlib import Path
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+# string columns with fewer distinct values than this proportion of rows are dictionary-encoded
+DICTIONARY_THRESHOLD = 0.5
+
+
+# read some (or all) columns of an Arrow output, as a pyarrow Table
+def read_columns(path, columns=None):
+    path = Path(path)
+    if path.suffix == ".parquet":
+        return pyarrow.parquet.read_table(path, columns=columns)
+    with pyarrow.ipc.open_file(pyarrow.memory_map(str(path), "r")) as reader:
+        batches = [
+            reader.get_batch(i) if columns is None else reader.get_batch(i).select(columns)
+            for i in range(reader.num_record_batches)
+        ]
+        schema = reader.schema if columns is None else pyarrow.schema([reader.schema.field(c) for c in columns])
+    return pyarrow.Table.from_batches(batches, schema=schema)
+
+# rows of a table in an ehrQL output directory (eg an output with event tables), as dicts, in file order
+def read_rows(directory, table_name):
+    directory = Path(directory)
+    for suffix in (".arrow", ".csv.gz", ".csv"):
+        path = directory / f"{table_name}{suffix}"
+        if path.exists():
+            return read_file_rows(path)
+    raise FileNotFoundError(f"No {table_name} table in {directory}")
+
+# rows of an Arrow or CSV output file, as dicts, in file order
+def read_file_rows(path):
+    path = Path(path)
+    if path.suffix == ".arrow":
+        return read_arrow_rows(path)
+    if path.suffix in (".csv", ".gz"):
+        return read_csv_rows(path)
+    raise ValueError(f"Not an Arrow or CSV file: {path}")
+
+def read_arrow_rows(path):
+    if pyarrow is None:
+        raise ImportError(f"Reading {path} needs pyarrow")
+    with pyarrow.ipc.open_file(pyarrow.memory_map(str(path), "r")) as reader:
+        for i in range(reader.num_record_batches):
+            yield from reader.get_batch(i).to_pylist()
+
+def read_csv_rows(path):
+    with (gzip.open(path, "rt", newline="") if path.suffix == ".gz" else open(path, newline="")) as f:
+        yield from csv.DictReader(f)
+
+# a CSV file to write, gzipped if the path ends in .gz
+def open_output(path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return gzip.open(path, "wt", newline="") if path.suffix == ".gz" else open(path, "w", newline="")
+
+# a value read by read_rows, as ehrQL writes it in CSV outputs (booleans as T / F, missing values empty)
+def csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "T" if value else "F"
+    return value
+
+# null count, and minimum and maximum (where defined), for each column
+def column_statistics(table):
+    statistics = {}
+    for name, column in zip(table.column_names, table.columns):
+        stats = {"type": str(column.type), "nulls": column.null_count}
+        if not pyarrow.types.is_dictionary(column.type) and not pyarrow.types.is_boolean(column.type):
+            min_max = pyarrow.compute.min_max(column)
+            stats["min"] = min_max["min"].as_py()
+            stats["max"] = min_max["max"].as_py()
+        elif pyarrow.types.is_boolean(column.type):
+            stats["true"] = pyarrow.compute.sum(column).as_py() or 0
+        statistics[name] = stats
+    return statistics
+
+def dictionary_encode(table):
+    for i, (name, column) in enumerate(zip(table.column_names, table.columns)):
+        if not pyarrow.types.is_string(column.type) or len(column) == 0:
+            continue
+        if pyarrow.compute.count_distinct(column).as_py() < DICTIONARY_THRESHOLD * len(column):
+            table = table.set_column(i, name, pyarrow.compute.dictionary_encode(column))
+    return table
+
+def to_parquet(path, output):
+    table = dictionary_encode(read_columns(path))
+    pyarrow.parquet.write_table(table, output, compression="zstd", write_statistics=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    stats_parser = subparsers.add_parser("stats", help="print the type and statistics of each column")
+    stats_parser.add_argument("path", type=Path)
+    stats_parser.add_argument("columns", nargs="*")
+    parquet_parser = subparsers.add_parser("to-parquet", help="convert an output to Parquet")
+    parquet_parser.add_argument("path", type=Path)
+    parquet_parser.add_argument("output", type=Path)
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        table = read_columns(args.path, args.columns or None)
+        print(f"{table.num_rows} rows")
+        for name, statistics in column_statistics(table).items():
+            print(f"{name}: " + ", ".join(f"{key}={value}" for key, value in statistics.items()))
+    elif args.command == "to-parquet":
+        to_parquet(args.path, args.output)
+
+
+if __name__ == "__main__":
+    main()
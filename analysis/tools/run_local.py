@@ -0,0 +1,79 @@
+# Run the dataset definitions in this repo against local event tables, rather than the database.
+#
+# ehrQL can evaluate a dataset definition against a directory of local tables (one file per table,
+# eg clinical_events.csv.gz, medications.arrow, ...) using `--dummy-tables`. This uses ehrQL's own
+# query engine, so results have exactly the same semantics as in the database, and the same
+# definitions and reusable functions are used unchanged in both modes.
+#
+# Usage (from the root of the repo):
+#   python analysis/tools/run_local.py --tables-dir dummy_tables --output-dir output/local
+#   python analysis/tools/run_local.py --tables-dir dummy_tables --output-dir output/local PRIMIS
+#
+# ehrQL is run from the current python environment if it is importable (eg in a codespace),
+# otherwise via `opensafely exec ehrql:v1`.
+
+import argparse
+import importlib.util
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+
+# dataset definitions in this repo, keyed by name
+DEFINITIONS = {
+    "ethnicity": Path("analysis/ethnicity/dataset_definition.py"),
+    "PRIMIS": Path("analysis/PRIMIS/dataset_definition.py"),
+    "vaccine-history": Path("analysis/vaccine-history/dataset_definition.py"),
+}
+
+def ehrql_command():
+    if importlib.util.find_spec("ehrql") is not None:
+        return [sys.executable, "-m", "ehrql"]
+    return ["opensafely", "exec", "ehrql:v1"]
+
+def generate_dataset_command(definition, tables_dir, output):
+    return [
+        *ehrql_command(), "generate-dataset", str(definition),
+        "--dummy-tables", str(tables_dir),
+        "--output", str(output),
+    ]
+
+# run a command, returning its wall time and peak memory use
+# (the process is reaped with wait4, which gives the peak memory of this process alone: RUSAGE_CHILDREN
+# is the largest of all children so far, so it would not show a later run using less)
+def run_timed(command):
+    start = time.perf_counter()
+    process = subprocess.Popen(command)
+    _, status, rusage = os.wait4(process.pid, 0)
+    wall_time = time.perf_counter() - start
+    # the process has been reaped, so Popen cannot wait for it: record its exit code ourselves
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+    return {"wall_time": wall_time, "peak_rss_mb": rusage.ru_maxrss / 1024}
+
+def run_definition(name, tables_dir, output_dir):
+    output = Path(output_dir) / name / "dataset.arrow"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    subprocess.run(generate_dataset_command(DEFINITIONS[name], tables_dir, output), check=True)
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("names", nargs="*", help=f"any of {', '.join(DEFINITIONS)} (default: all)")
+    parser.add_argument("--tables-dir", type=Path, required=True)
+    parser.add_argument("--output-dir", type=Path, default=Path("output/local"))
+    args = parser.parse_args()
+    unknown = set(args.names) - set(DEFINITIONS)
+    if unknown:
+        parser.error(f"unknown dataset definitions: {', '.join(sorted(unknown))}")
+    for name in args.names or DEFINITIONS:
+        output = run_definition(name, args.tables_dir, args.output_dir)
+        print(f"{name}: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+# Run a dataset definition against local tables in parallel, one process per shard of patients.
+#
+# `generate-dataset` evaluates a definition on a single core. Every variable in this repo is computed
+# per patient, so the local tables (see dummy_tables.py) can instead be split into K shards by
+# patient_id, and the same definition run against each shard at the same time. Each shard only
+# contains its own patients' rows in every table, so define_population and every variable give the
+# same result for each patient as in an unsharded run.
+#
+# The shard outputs are then merged in patient_id order. CSV outputs are merged line by line, so
+# the merged file has exactly the same rows, in the same order, as an unsharded run. Arrow outputs are
+# merged with pyarrow, keeping the column types of the shards, so the merged table is equal to an
+# unsharded run's (record batch layout may differ).
+#
+# Timing and peak memory of each shard are printed, and written as JSON next to the output.
+#
+# Usage (from the root of the repo):
+#   python analysis/tools/run_sharded.py PRIMIS --tables-dir dummy_tables --shards 8 --output output/local/PRIMIS/dataset.csv.gz
+#   python analysis/tools/run_sharded.py PRIMIS --tables-dir dummy_tables --shards 8 --jobs 4 --output output/local/PRIMIS/dataset.arrow
+
+import argparse
+import csv
+import gzip
+import heapq
+import json
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from pathlib import Path
+
+from run_local import DEFINITIONS, generate_dataset_command, run_timed
+
+
+# local table files, as written by dummy_tables.py
+TABLE_SUFFIXES = (".csv.gz", ".csv")
+
+
+def shard_of(patient_id, shards):
+    return int(patient_id) % shards
+
+def open_text(path, mode):
+    if path.name.endswith(".gz"):
+        return gzip.open(path, mode + "t", newline="")
+    return open(path, mode, newline="")
+
+def table_files(tables_dir):
+    return sorted(
+        path for path in Path(tables_dir).iterdir()
+        if path.name.endswith(TABLE_SUFFIXES)
+    )
+
+
+#####################################################
+# Splitting tables
+#####################################################
+
+# split each table in tables_dir into shards_dir/0, ..., shards_dir/{shards - 1}, streaming rows
+# (so memory use does not depend on the size of the tables)
+def split_tables(tables_dir, shards_dir, shards):
+    shard_dirs = [Path(shards_dir) / str(shard) for shard in range(shards)]
+    for shard_dir in shard_dirs:
+        shard_dir.mkdir(parents=True, exist_ok=True)
+    for path in table_files(tables_dir):
+        with ExitStack() as stack:
+            reader = csv.reader(stack.enter_context(open_text(path, "r")))
+            header = next(reader)
+            patient_id_column = header.index("patient_id")
+            writers = []
+            for shard_dir in shard_dirs:
+                writer = csv.writer(stack.enter_context(open_text(shard_dir / path.name, "w")))
+                writer.writerow(header)
+                writers.append(writer)
+            for row in reader:
+                writers[shard_of(row[patient_id_column], shards)].writerow(row)
+    return shard_dirs
+
+# shards are reused while they are newer than the tables they were split from
+def shards_up_to_date(tables_dir, shards_dir, shards):
+    marker = Path(shards_dir) / "shards.json"
+    if not marker.exists() or json.loads(marker.read_text()) != {"shards": shards}:
+        return False
+    return all(marker.stat().st_mtime >= path.stat().st_mtime for path in table_files(tables_dir))
+
+def ensure_shards(tables_dir, shards_dir, shards):
+    if not shards_up_to_date(tables_dir, shards_dir, shards):
+        shutil.rmtree(shards_dir, ignore_errors=True)
+        split_tables(tables_dir, shards_dir, shards)
+        (Path(shards_dir) / "shards.json").write_text(json.dumps({"shards": shards}))
+    return [Path(shards_dir) / str(shard) for shard in range(shards)]
+
+
+#####################################################
+# Merging outputs
+#####################################################
+
+def _csv_rows(path):
+    with open_text(path, "r") as f:
+        header = f.readline()
+        yield header
+        previous = None
+        for line in f:
+            patient_id = int(line.partition(",")[0])
+            if previous is not None and patient_id < previous:
+                raise ValueError(f"{path} is not sorted by patient_id")
+            previous = patient_id
+            yield patient_id, line
+
+def merge_csv(paths, output):
+    readers = [_csv_rows(path) for path in paths]
+    headers = {next(reader) for reader in readers}
+    if len(headers) != 1:
+        raise ValueError("Shard outputs have different columns")
+    with open_text(output, "w") as f:
+        f.write(headers.pop())
+        for _, line in heapq.merge(*readers, key=lambda row: row[0]):
+            f.write(line)
+
+def merge_arrow(paths, output):
+    import pyarrow
+    import pyarrow.ipc
+
+    tables = []
+    for path in paths:
+        with pyarrow.ipc.open_file(pyarrow.memory_map(str(path), "r")) as reader:
+            tables.append(reader.read_all())
+    schemas = {table.schema for table in tables}
+    if len(schemas) != 1:
+        raise ValueError("Shard outputs have different schemas")
+    # each shard is already in patient_id order, so a stable sort of the concatenation is a merge
+    table = pyarrow.concat_tables(tables).sort_by("patient_id").unify_dictionaries()
+    with pyarrow.ipc.new_file(str(output), table.schema) as writer:
+        writer.write_table(table)
+
+def merge_outputs(paths, output):
+    Path(output).parent.mkdir(parents=True, exist_ok=True)
+    if Path(output).suffix == ".arrow":
+        merge_arrow(paths, output)
+    else:
+        merge_csv(paths, output)
+
+
+#####################################################
+# Running shards
+#####################################################
+
+def output_suffix(output):
+    name = Path(output).name
+    return name[name.index("."):]
+
+def run_shard(definition, shard_dir, output):
+    output.parent.mkdir(parents=True, exist_ok=True)
+    return run_timed(generate_dataset_command(definition, shard_dir, output))
+
+def run_sharded(name, tables_dir, shards, jobs, output, shards_dir):
+    shard_dirs = ensure_shards(tables_dir, shards_dir, shards)
+    shard_outputs = [
+        Path(shards_dir) / "outputs" / f"{name}-{shard}{output_suffix(output)}" for shard in range(shards)
+    ]
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [
+            executor.submit(run_shard, DEFINITIONS[name], shard_dir, shard_output)
+            for shard_dir, shard_output in zip(shard_dirs, shard_outputs)
+        ]
+        shard_results = [future.result() for future in futures]
+    merge_outputs(shard_outputs, output)
+    return shard_results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("name", help=f"one of {', '.join(DEFINITIONS)}")
+    parser.add_argument("--tables-dir", type=Path, required=True)
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--jobs", type=int, help="number of shards to run at once (default: all)")
+    parser.add_argument("--output", type=Path, required=True, help="merged output (.arrow, .csv or .csv.gz)")
+    parser.add_argument("--shards-dir", type=Path, help="where to write shard tables and outputs")
+    args = parser.parse_args()
+    if args.name not in DEFINITIONS:
+        parser.error(f"unknown dataset definition: {args.name}")
+    shards_dir = args.shards_dir or args.tables_dir.with_name(f"{args.tables_dir.name}-shards")
+
+    shard_results = run_sharded(
+        args.name, args.tables_dir, args.shards, args.jobs or args.shards, args.output, shards_dir
+    )
+    for shard, result in enumerate(shard_results):
+        print(f"shard {shard}: {result['wall_time']:.1f}s, {result['peak_rss_mb']:.0f} MB")
+    timings = args.output.with_name(f"{args.output.name.partition('.')[0]}-shards.json")
+    timings.write_text(json.dumps(shard_results, indent=2))
+    print(f"{args.name}: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
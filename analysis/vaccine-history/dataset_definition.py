@@ -31,4 +31,12 @@ add_vaccine_history(
     number_of_vaccines = 10
 )
 
+# several target diseases at once
+
+add_vaccine_histories(
+    dataset = dataset, index_date = index_date,
+    target_diseases = {"Influenza": "flu", "Pneumococcal": "pneumococcal"},
+    number_of_vaccines = {"flu": 20, "pneumococcal": 2}
+)
+
 
@@ -2,6 +2,8 @@
 
 # vaccination target diseases are here: 
 # https://jobs.opensafely.org/opensafely-internal/tpp-database-categorical-columns/outputs/99/output/results_tpp.csv
+# matching on target_disease is case-sensitive: use the values exactly as listed there,
+# eg "SARS-2 Coronavirus", "Influenza", "Pneumococcal"
 
 # vaccination product names are here: 
 # https://reports.opensafely.org/reports/opensafely-tpp-vaccination-names/
@@ -12,6 +14,11 @@
 # Import relevant functions and scripts
 #####################################################
 
+import datetime
+
+from ehrql import case, when
+from ehrql.tables import PatientFrame, Series, table_from_file
+
 from ehrql.tables.tpp import (
   vaccinations
 )
@@ -24,24 +31,147 @@ from ehrql.tables.tpp import (
 def add_vaccine_history(dataset, index_date, target_disease, target_disease_short, number_of_vaccines = 10):
 
     # select all vaccination events that target {target_disease} on or before {index_date}
-    covid_vaccinations = (
+    target_vaccinations = (
         vaccinations
         .where(vaccinations.target_disease == target_disease)
         .where(vaccinations.date <= index_date)
         .sort_by(vaccinations.date)
     )
+
+    add_vaccine_doses(dataset, target_vaccinations, target_disease_short, number_of_vaccines)
+
+
+# add date and product of the first {number_of_vaccines} doses in {target_vaccinations}
+def add_vaccine_doses(dataset, target_vaccinations, target_disease_short, number_of_vaccines):
         
     # Arbitrary date guaranteed to be before any vaccination events of interest
     previous_vax_date = "1899-01-01"
 
     # loop over first, second, ..., nth vaccination event for each person
     # extract info on vaccination date and type
+    # ehrQL has no way of numbering a patient's rows (there is no rank / nth_for_patient),
+    # so dose i has to be found relative to dose i-1. Taking the first event strictly after the
+    # previous dose date is also what de-duplicates multiple doses recorded on the same day.
+    # So each dose's first_for_patient() filters on the previous dose's patient-level result,
+    # and the query is a chain of {number_of_vaccines} nested aggregations; this cannot be avoided
+    # in ehrQL. To number doses by rank instead, extract the events in long format
+    # (add_vaccine_events) and use analysis/tools/pivot_vaccine_history.py.
     for i in range(1, number_of_vaccines + 1):
 
         # vaccine variables
-        current_vax = covid_vaccinations.where(covid_vaccinations.date>previous_vax_date).first_for_patient()
+        current_vax = target_vaccinations.where(target_vaccinations.date>previous_vax_date).first_for_patient()
         dataset.add_column(f"vax_{target_disease_short}_{i}_date", current_vax.date)
         dataset.add_column(f"vax_{target_disease_short}_{i}_type", current_vax.product_name)
         
         previous_vax_date = current_vax.date
 
+
+#####################################################
+# Define function to extract vaccine history for several target diseases
+#####################################################
+
+# target_diseases maps each target disease to its short name, eg {"SARS-2 Coronavirus": "covid", "Influenza": "flu"}
+# number_of_vaccines is either a single number, or a dict mapping short names to the number of doses for that disease
+# As well as the dose dates and products, for each disease this adds:
+#   vax_{short}_count: the number of doses (distinct vaccination dates) on or before {index_date}
+#   vax_{short}_last_date: the date of the most recent dose on or before {index_date}
+
+def add_vaccine_histories(dataset, index_date, target_diseases, number_of_vaccines = 10):
+
+    for target_disease, target_disease_short in target_diseases.items():
+
+        if isinstance(number_of_vaccines, dict):
+            disease_number_of_vaccines = number_of_vaccines[target_disease_short]
+        else:
+            disease_number_of_vaccines = number_of_vaccines
+
+        # select all vaccination events that target {target_disease} on or before {index_date}
+        target_vaccinations = (
+            vaccinations
+            .where(vaccinations.target_disease == target_disease)
+            .where(vaccinations.date <= index_date)
+            .sort_by(vaccinations.date)
+        )
+
+        add_vaccine_doses(dataset, target_vaccinations, target_disease_short, disease_number_of_vaccines)
+
+        dataset.add_column(f"vax_{target_disease_short}_count", target_vaccinations.date.count_distinct_for_patient())
+        dataset.add_column(f"vax_{target_disease_short}_last_date", target_vaccinations.date.maximum_for_patient())
+
+
+#####################################################
+# Define function to extract vaccine history in long format
+#####################################################
+
+# Rather than 2 x {number_of_vaccines} mostly-empty columns per patient, this adds an event table
+# with one row per vaccination event targeting any of {target_diseases} on or before {index_date}:
+#   patient_id, target_disease, date, product_name
+# There is no limit on the number of doses, and the output only grows with the doses actually given.
+# Event tables need a directory output, eg `--output output/vaccine-history-long:arrow`.
+# Dose numbers (with same-day doses de-duplicated, as in add_vaccine_history), and the wide
+# vax_{short}_{i}_date / _type columns, can be recovered with analysis/tools/pivot_vaccine_history.py.
+
+def add_vaccine_events(dataset, index_date, target_diseases, table_name = "vaccinations"):
+
+    target_vaccinations = (
+        vaccinations
+        .where(vaccinations.target_disease.is_in(list(target_diseases)))
+        .where(vaccinations.date <= index_date)
+    )
+
+    dataset.add_event_table(
+        table_name,
+        target_disease = target_vaccinations.target_disease,
+        date = target_vaccinations.date,
+        product_name = target_vaccinations.product_name,
+    )
+
+
+#####################################################
+# Define function to advance vaccine history to a later index date
+#####################################################
+
+# patient table of a previous add_vaccine_history output, eg
+#   previous_history = vaccine_history_table("output/vaccine-history/dataset.arrow", "covid", 10)
+def vaccine_history_table(path, target_disease_short, number_of_vaccines = 10):
+    columns = {}
+    for i in range(1, number_of_vaccines + 1):
+        columns[f"vax_{target_disease_short}_{i}_date"] = Series(datetime.date)
+        columns[f"vax_{target_disease_short}_{i}_type"] = Series(str)
+    return table_from_file(path)(type(f"vaccine_history_{target_disease_short}", (PatientFrame,), columns))
+
+# Adds the same columns as add_vaccine_history, for {index_date}, given the history extracted for
+# {previous_index_date}. Doses in the previous history are kept, and later doses are taken only from
+# vaccinations after {previous_index_date}, so eg a weekly update reads one week of vaccinations.
+# Patients not in the previous history (eg newly registered) are extracted from their full history.
+# The result matches add_vaccine_history, except for vaccinations that were added to the record after
+# the previous extract but dated on or before {previous_index_date}.
+def add_advanced_vaccine_history(dataset, previous_history, previous_index_date, index_date, target_disease, target_disease_short, number_of_vaccines = 10):
+
+    in_previous_history = previous_history.exists_for_patient()
+
+    # select vaccination events that target {target_disease} since {previous_index_date} and on or before {index_date}
+    new_vaccinations = (
+        vaccinations
+        .where(vaccinations.target_disease == target_disease)
+        .where(vaccinations.date <= index_date)
+        .where((vaccinations.date > previous_index_date) | ~in_previous_history)
+        .sort_by(vaccinations.date)
+    )
+
+    # Arbitrary date guaranteed to be before any vaccination events of interest
+    previous_vax_date = "1899-01-01"
+
+    # as add_vaccine_doses, but using the dose from {previous_history} where there is one
+    for i in range(1, number_of_vaccines + 1):
+
+        previous_date = getattr(previous_history, f"vax_{target_disease_short}_{i}_date")
+        previous_type = getattr(previous_history, f"vax_{target_disease_short}_{i}_type")
+        new_vax = new_vaccinations.where(new_vaccinations.date>previous_vax_date).first_for_patient()
+
+        current_vax_date = case(when(previous_date.is_not_null()).then(previous_date), otherwise=new_vax.date)
+        current_vax_type = case(when(previous_date.is_not_null()).then(previous_type), otherwise=new_vax.product_name)
+        dataset.add_column(f"vax_{target_disease_short}_{i}_date", current_vax_date)
+        dataset.add_column(f"vax_{target_disease_short}_{i}_type", current_vax_type)
+
+        previous_vax_date = current_vax_date